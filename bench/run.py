@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Time each stage of routing and printing synthetic orders at increasing scale.
+
+Run from the top of the repository:
+
+  python -m bench.run --sizes 500,5000 --report bench.json
+  python -m bench.run --baseline bench.json
+"""
+
+import argparse
+import datetime
+import platform
+import tempfile
+import shutil
+import numpy
+import json
+import time
+import csv
+import sys
+import os
+
+import printer
+
+from bench import synthetic
+from lib.config import Config
+from lib.export import export_routes
+from lib.orders import load_routes
+from lib.route_calc import RouteCalc
+from lib.solvers import SOLVERS
+
+SIZES = [500, 1000, 5000, 10000, 50000, 100000]
+STAGES = ["validate_data", "calculate_adjacencies", "route", "save_routes", "export_kml", "print"]
+
+def bench_config(args, workdir):
+  c = Config()
+  c.verbose = False
+  c.output_dir = os.path.join(workdir, "output")
+  c.geocode_cache = os.path.join(workdir, "geocodes.db")
+  # never touch the real geocoders, every address is in the seeded cache
+  c.smarty_auth_id = None
+  c.google_api_key = None
+  c.solver = args.solver
+  c.processes = args.processes or c.processes
+  return c
+
+def run_size(args, n, workdir):
+  """Generate n orders and time each stage on them, returning the run's entry for the report"""
+  os.makedirs(workdir)
+  c = bench_config(args, workdir)
+  os.makedirs(c.output_dir)
+
+  (rows, coords) = synthetic.generate_orders(c, n, args.seed)
+  ordersfile = os.path.join(workdir, "orders.csv")
+  synthetic.write_csv(c, ordersfile, rows)
+  synthetic.seed_geocode_cache(c, rows, coords)
+
+  seconds = {}
+  def timed(stage, fn):
+    if stage not in args.stages:
+      return None
+    start = time.perf_counter()
+    result = fn()
+    seconds[stage] = round(time.perf_counter() - start, 4)
+    return result
+
+  r = RouteCalc(c)
+  # read the CSV the way router.py does
+  def load():
+    with open(ordersfile, mode="r", encoding="utf-8-sig") as data_file:
+      r.load_csv(list(csv.DictReader(data_file)))
+  timed("validate_data", load)
+  if r.data is None:
+    load()
+
+  timed("calculate_adjacencies", r.calculate_adjacencies)
+  timed("route", r.route)
+  if not os.path.isfile(r.output_file("routes")):
+    r.route()
+
+  delivery_routes = [[d['id'] for d in route] for route in load_routes(r.output_file("routes"))]
+  def save():
+    routes = r.expand_routes(delivery_routes)
+    r.save_routes(routes)
+    return routes
+  routes = timed("save_routes", save) or r.expand_routes(delivery_routes)
+
+  timed("export_kml", lambda: export_routes(c, routes, ["kml"]))
+  timed("print", lambda: printer.print_routes(c, routes, True))
+
+  return {"orders": len(r.data), "routes": len(routes), "bags": int(r.data.count.sum()), "seconds": seconds}
+
+def compare(report, baseline):
+  """Print each stage's time next to the same stage and size in a baseline report"""
+  before = {(run["orders"], stage): t for run in baseline["runs"] for stage, t in run["seconds"].items()}
+  for run in report["runs"]:
+    for stage, t in run["seconds"].items():
+      was = before.get((run["orders"], stage))
+      if was:
+        print("{:>7} orders {:<22} {:9.3f}s (was {:.3f}s, {:+.0%})".format(run["orders"], stage, t, was, t / was - 1))
+
+def git_version():
+  try:
+    import subprocess
+    return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL).decode().strip()
+  except Exception:
+    return None
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark routing and printing on synthetic orders.')
+  parser.add_argument('--sizes', type=str, default=",".join(str(s) for s in SIZES), help='comma separated order counts to run')
+  parser.add_argument('--stages', type=str, default=",".join(STAGES), help='comma separated stages to time (from {})'.format(", ".join(STAGES)))
+  parser.add_argument('-s', '--solver', choices=sorted(SOLVERS), default='greedy', help='the routing engine to use')
+  parser.add_argument('-p', '--processes', type=int, help='worker processes (defaults to Config.processes)')
+  parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic orders')
+  parser.add_argument('-r', '--report', type=str, default='bench.json', help='where to write the JSON report')
+  parser.add_argument('-b', '--baseline', type=str, help='an earlier report to compare against')
+  parser.add_argument('--workdir', type=str, help='keep the generated orders and outputs here (a temporary directory by default)')
+  args = parser.parse_args()
+
+  args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+  unknown = [s for s in args.stages if s not in STAGES]
+  if unknown:
+    print("ERROR: Unknown stage {} (choose from {})!".format(", ".join(unknown), ", ".join(STAGES)))
+    sys.exit(-1)
+
+  workdir = args.workdir or tempfile.mkdtemp(prefix="delivery-routes-bench-")
+  report = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "version": git_version(),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "solver": args.solver,
+            "seed": args.seed,
+            "runs": []}
+  try:
+    for n in [int(s) for s in args.sizes.split(",")]:
+      run = run_size(args, n, os.path.join(workdir, str(n)))
+      report["runs"].append(run)
+      print("{:>7} orders, {:>5} routes: {}".format(run["orders"], run["routes"],
+            ", ".join("{} {:.3f}s".format(stage, t) for stage, t in run["seconds"].items())))
+  finally:
+    if not args.workdir:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+  with open(args.report, "w") as f:
+    json.dump(report, f, indent=2)
+  print("Saved the report to {}".format(args.report))
+
+  if args.baseline:
+    with open(args.baseline, "r") as f:
+      compare(report, json.load(f))
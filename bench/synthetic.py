@@ -0,0 +1,85 @@
+import random
+import math
+import csv
+
+from lib.geocode_cache import GeocodeCache
+
+# Neighborhoods are placed this far (in miles) from the depot
+MIN_MILES = 1.5
+MAX_MILES = 18.0
+# Spread (standard deviation, in miles) of the houses around a neighborhood's center
+CLUSTER_MILES = 0.6
+# About this many orders come from each neighborhood
+ORDERS_PER_CLUSTER = 150
+
+# Bags per order, weighted the way a mulch sale's orders come in: mostly 5 to 20, a few big ones
+BAG_COUNTS = [2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30, 40, 50, 60]
+BAG_WEIGHTS = [3, 6, 4, 14, 6, 8, 16, 6, 10, 12, 4, 4, 3, 2, 1]
+
+TOWNS = [("Herndon", "20170"), ("Herndon", "20171"), ("Reston", "20190"), ("Reston", "20191"),
+         ("Reston", "20194"), ("Sterling", "20164"), ("Sterling", "20165"), ("Chantilly", "20151"),
+         ("Oak Hill", "20171"), ("Ashburn", "20147"), ("Fairfax", "22030"), ("Vienna", "22180")]
+STREETS = ["Elden", "Center", "Monroe", "Grove", "Dranesville", "Spring", "Fairfax", "Locust",
+           "Pine", "Oak", "Maple", "Ferndale", "Wiehle", "Sunrise Valley", "Bennett", "Alabama",
+           "Kingston", "Worland", "Crestview", "Coppermine", "Fox Mill", "Stuart Mill", "Folly Lick",
+           "Park", "Ridge Heights", "Hunter Mill", "Mandolin", "Seneca", "Polo", "Bradley"]
+SUFFIXES = ["St", "Rd", "Dr", "Ct", "Ln", "Way", "Pl", "Cir"]
+FIRST_NAMES = ["Alex", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Drew"]
+LAST_NAMES = ["Smith", "Nguyen", "Garcia", "Patel", "Kim", "Johnson", "Brown", "Lee", "Martin", "Clark"]
+NOTES = ["", "", "", "", "", "Leave by the mailbox", "Put on the driveway", "Behind the garage", "Call on arrival"]
+
+# miles per degree of latitude
+MILES_PER_DEGREE = 69.05
+
+def generate_orders(config, n, seed=0):
+  """n synthetic orders clustered in neighborhoods around Config.origin.
+
+  Returns (rows, coords): the rows laid out like Shopify's order export (the columns Config.mappings
+  reads) and the (lat, lon) of each order's address.
+  """
+  rng = random.Random(seed)
+  origin_lat, origin_lon = config.origin
+  lon_miles = MILES_PER_DEGREE * math.cos(math.radians(origin_lat))
+
+  clusters = []
+  for c in range(max(1, n // ORDERS_PER_CLUSTER)):
+    bearing = rng.uniform(0, 2 * math.pi)
+    miles = rng.uniform(MIN_MILES, MAX_MILES)
+    town, zipc = TOWNS[c % len(TOWNS)]
+    clusters.append((origin_lat + miles * math.cos(bearing) / MILES_PER_DEGREE,
+                     origin_lon + miles * math.sin(bearing) / lon_miles,
+                     town, zipc, "{} {}".format(STREETS[c % len(STREETS)], SUFFIXES[(c // len(STREETS)) % len(SUFFIXES)])))
+
+  key = config.map_key
+  rows = []
+  coords = []
+  for i in range(n):
+    (lat, lon, town, zipc, street) = rng.choice(clusters)
+    # house numbers are unique across the whole set so every order has its own address
+    rows.append({key('ID'): "#{}".format(1001 + i),
+                 key('NAME'): "{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+                 key('ADDRESS'): "{} {}".format(100 + i, street),
+                 key('TOWN'): town,
+                 key('STATE'): "VA",
+                 key('ZIP'): "'{}".format(zipc),
+                 key('BAGS'): str(rng.choices(BAG_COUNTS, BAG_WEIGHTS)[0]),
+                 key('COMMENTS'): rng.choice(NOTES)})
+    coords.append((lat + rng.gauss(0, CLUSTER_MILES) / MILES_PER_DEGREE,
+                   lon + rng.gauss(0, CLUSTER_MILES) / lon_miles))
+
+  return (rows, coords)
+
+def write_csv(config, filename, rows):
+  fields = [config.map_key(k) for k in ('ID', 'NAME', 'ADDRESS', 'TOWN', 'STATE', 'ZIP', 'BAGS', 'COMMENTS')]
+  with open(filename, "w") as csvfile:
+    f = csv.DictWriter(csvfile, fieldnames=fields)
+    f.writeheader()
+    f.writerows(rows)
+
+def seed_geocode_cache(config, rows, coords):
+  """Put the orders' coordinates in the geocode cache at Config.geocode_cache, so routing them never geocodes"""
+  key = config.map_key
+  cache = GeocodeCache(config.geocode_cache)
+  cache.put_many([(GeocodeCache.normalize(row[key('ADDRESS')], row[key('TOWN')], row[key('STATE')], row[key('ZIP')]), lat, lon)
+                  for row, (lat, lon) in zip(rows, coords)], "synthetic")
+  cache.close()
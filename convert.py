@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+import os
+
+from lib import store
+
+def load(filename):
+  """Load a routes or orders file in either format; routes come back as a list, orders as a dict keyed by ID"""
+  if store.is_ndjson(filename):
+    records = list(store.iter_ndjson(filename))
+    # routes.ndjson has a list of orders per line, orders.ndjson a single order
+    if records and isinstance(records[0], dict):
+      return {r['id']: r for r in records}
+    return records
+
+  with open(filename, 'r') as f:
+    return json.load(f)
+
+def save(filename, data):
+  if store.is_ndjson(filename):
+    records = data.values() if isinstance(data, dict) else data
+    return store.write_ndjson(filename, records)
+
+  with open(filename, 'w') as f:
+    json.dump(data, f, indent=2)
+  return len(data)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Convert a routes or orders file between JSON (for hand editing) and indexed NDJSON.')
+  parser.add_argument('input', type=str, help='the routes/orders file to convert (.json or .ndjson)')
+  parser.add_argument('output', type=str, help='the file to write, its extension (.json or .ndjson) picks the format')
+  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
+  args = parser.parse_args()
+
+  if not os.path.isfile(args.input):
+    print("There is no such file {}!".format(args.input))
+    sys.exit(-1)
+
+  num = save(args.output, load(args.input))
+
+  if args.verbose:
+    print("Converted {} records from {} to {}".format(num, args.input, args.output))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import os
+
+from lib import metrics
+from lib.config import Config
+from lib.export import WRITERS, export_routes
+from lib.store import open_routes
+
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Write any of the CSV/KML/GeoJSON outputs for a routes file in a single pass over it.')
+  parser.add_argument('filename', type=str, help='the routes.json (or routes.ndjson) file to export')
+  parser.add_argument('-o', '--outputs', type=str, default=",".join(WRITERS),
+                      help='comma separated outputs to write (from {}, default all)'.format(", ".join(WRITERS)))
+  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
+  metrics.add_arguments(parser)
+  args = parser.parse_args(argv)
+
+  c = Config()
+  c.verbose = args.verbose
+  metrics.start(args, c.verbose)
+
+  if not os.path.isfile(args.filename):
+    print("There is no such file {}!".format(args.filename))
+    sys.exit(-1)
+
+  outputs = [o.strip() for o in args.outputs.split(",") if o.strip()]
+  unknown = [o for o in outputs if o not in WRITERS]
+  if unknown:
+    print("ERROR: Unknown output {} (choose from {})!".format(", ".join(unknown), ", ".join(WRITERS)))
+    sys.exit(-1)
+
+  # routes.ndjson files are streamed a route at a time rather than loaded whole
+  summaries = export_routes(c, open_routes(args.filename), outputs)
+
+  if c.verbose:
+    print("Exported {} routes with {} bags to {}".format(len(summaries), sum(s.bags for s in summaries), ", ".join(outputs)))
+
+if __name__ == '__main__':
+  main()
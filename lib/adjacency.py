@@ -0,0 +1,265 @@
+import hashlib
+import json
+import numpy
+import os
+
+from lib import distance
+from lib.spatial import GridIndex
+
+class Adjacencies:
+  """Per-order neighbor lists, nearest first, capped by radius (miles) and count (k).
+
+  Stored as flat arrays (row i's neighbors are neighbors[indptr[i]:indptr[i+1]]) so memory
+  grows with n * k rather than n * n. Indexing by order ID yields (id, distance) pairs, the
+  same shape the old dict of sorted lists had, so chunk_deliveries can walk either one.
+  """
+  ARRAYS = ("lats", "lons", "indptr", "neighbors", "dists")
+
+  def __init__(self, ids, lats, lons, indptr, neighbors, dists, radius, k):
+    self.ids = list(ids)
+    self.index = {id: i for i, id in enumerate(self.ids)}
+    self.lats = lats
+    self.lons = lons
+    self.indptr = indptr
+    self.neighbors = neighbors
+    self.dists = dists
+    self.radius = radius
+    self.k = k
+
+  @classmethod
+  def build(cls, ids, lats, lons, radius, k):
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    grid = GridIndex(lats, lons, radius)
+    # orders that failed to geocode are in no grid cell and keep an empty row
+    empty = (numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float64))
+    rows = [empty] * len(lats)
+
+    # Work a grid cell at a time: every point in a cell shares the same candidate set, so the
+    # distances for the whole cell come out of one vectorized call
+    for members in grid.cells.values():
+      cand = grid.candidates(lats[members[0]], lons[members[0]], radius)
+      block = distance.distance_matrix(lats[members], lons[members], lats[cand], lons[cand])
+      for r, i in enumerate(members.tolist()):
+        keep = (block[r] <= radius) & (cand != i)
+        c, d = cand[keep], block[r][keep]
+        order = numpy.argsort(d, kind="stable")[:k]
+        rows[i] = (c[order], d[order])
+
+    return cls.from_rows(ids, lats, lons, rows, radius, k)
+
+  @classmethod
+  def from_rows(cls, ids, lats, lons, rows, radius, k):
+    counts = numpy.array([len(r[0]) for r in rows], dtype=numpy.int64)
+    indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=indptr[1:])
+    if rows:
+      neighbors = numpy.concatenate([r[0] for r in rows]).astype(numpy.int32)
+      dists = numpy.concatenate([r[1] for r in rows]).astype(numpy.float32)
+    else:
+      neighbors = numpy.empty(0, dtype=numpy.int32)
+      dists = numpy.empty(0, dtype=numpy.float32)
+    return cls(ids, numpy.asarray(lats, dtype=numpy.float64), numpy.asarray(lons, dtype=numpy.float64),
+               indptr, neighbors, dists, radius, k)
+
+  def diff(self, ids, lats, lons):
+    """Compare against another set of orders: return (added, removed, moved) order IDs"""
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    new_ids = set(ids)
+    added = [id for id in ids if id not in self.index]
+    removed = [id for id in self.ids if id not in new_ids]
+    moved = [id for i, id in enumerate(ids) if id in self.index and
+             (self.lats[self.index[id]] != lats[i] or self.lons[self.index[id]] != lons[i])]
+    return (added, removed, moved)
+
+  def update(self, ids, lats, lons):
+    """Return the neighbor lists for a new set of orders, with work in proportion to the changes.
+
+    Rows of orders that stayed put are carried over, minus their entries for removed or moved orders.
+    Added and moved orders get fresh rows and are inserted into the rows of the orders around them,
+    each of which then keeps its k nearest. A row that loses an entry while holding k of them may have
+    had more neighbors within the radius than it kept, so only those rows are looked up again.
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    n = len(ids)
+
+    # where each order was in the old lists (-1 when added), and which of them stayed put
+    old = numpy.array([self.index.get(id, -1) for id in ids], dtype=numpy.int64)
+    was = old >= 0
+    old_lats, old_lons = numpy.asarray(self.lats)[old[was]], numpy.asarray(self.lons)[old[was]]
+    same = numpy.zeros(n, dtype=bool)
+    same[was] = (((old_lats == lats[was]) | (numpy.isnan(old_lats) & numpy.isnan(lats[was]))) &
+                 ((old_lons == lons[was]) | (numpy.isnan(old_lons) & numpy.isnan(lons[was]))))
+    fresh = numpy.flatnonzero(~same)
+    remap = numpy.full(len(self.ids), -1, dtype=numpy.int64)
+    remap[old[same]] = numpy.flatnonzero(same)
+
+    # the old entries with both ends renumbered; entries of removed or moved orders drop out
+    counts = numpy.diff(numpy.asarray(self.indptr))
+    src = remap[numpy.repeat(numpy.arange(len(self.ids)), counts)]
+    dst = remap[numpy.asarray(self.neighbors, dtype=numpy.int64)]
+    dist = numpy.asarray(self.dists, dtype=numpy.float64)
+    capped = numpy.repeat(counts >= self.k, counts) if self.k else numpy.zeros(len(src), dtype=bool)
+    requery = numpy.unique(src[(src >= 0) & (dst < 0) & capped])
+    keep = (src >= 0) & (dst >= 0)
+    src, dst, dist = src[keep], dst[keep], dist[keep]
+    if len(src) > 1 and (src[1:] < src[:-1]).any():
+      # the orders came in a different order; a stable sort keeps each row nearest first
+      order = numpy.argsort(src, kind="stable")
+      src, dst, dist = src[order], dst[order], dist[order]
+
+    redo = numpy.zeros(n, dtype=bool)
+    redo[fresh] = True
+    redo[requery] = True
+    grid = GridIndex(lats, lons, self.radius)
+    extra = []
+    for i in fresh.tolist():
+      idx, d = grid.query(lats[i], lons[i], self.radius, exclude=i)
+      own = slice(None, self.k)
+      extra.append((numpy.full(len(idx[own]), i), idx[own], d[own]))
+      # i is a candidate neighbor for each order within the radius of it
+      around = ~redo[idx]
+      extra.append((idx[around], numpy.full(int(around.sum()), i), d[around]))
+    for i in numpy.setdiff1d(requery, fresh).tolist():
+      idx, d = grid.query(lats[i], lons[i], self.radius, self.k, exclude=i)
+      extra.append((numpy.full(len(idx), i), idx, d))
+
+    e_src = numpy.concatenate([e[0] for e in extra] + [numpy.empty(0)]).astype(numpy.int64)
+    e_dst = numpy.concatenate([e[1] for e in extra] + [numpy.empty(0)]).astype(numpy.int64)
+    e_dist = numpy.concatenate([e[2] for e in extra] + [numpy.empty(0)])
+
+    # rows that gained an entry are sorted again and cut back to k, the rest stay as they are
+    touched = redo.copy()
+    touched[e_src] = True
+    move = touched[src] & ~redo[src]
+    e_src = numpy.concatenate((e_src, src[move]))
+    e_dst = numpy.concatenate((e_dst, dst[move]))
+    e_dist = numpy.concatenate((e_dist, dist[move]))
+    rest = ~touched[src]
+    src, dst, dist = src[rest], dst[rest], dist[rest]
+    order = numpy.lexsort((e_dst, e_dist, e_src))
+    e_src, e_dst, e_dist = e_src[order], e_dst[order], e_dist[order]
+    if self.k:
+      keep = _ranks(e_src) < self.k
+      e_src, e_dst, e_dist = e_src[keep], e_dst[keep], e_dist[keep]
+
+    # lay both sets of (grouped, nearest first) entries out row by row
+    indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src, minlength=n) + numpy.bincount(e_src, minlength=n), out=indptr[1:])
+    neighbors = numpy.empty(indptr[-1], dtype=numpy.int32)
+    dists = numpy.empty(indptr[-1], dtype=numpy.float32)
+    offset = numpy.bincount(src, minlength=n)
+    pos = indptr[src] + _ranks(src)
+    neighbors[pos], dists[pos] = dst, dist
+    pos = indptr[e_src] + offset[e_src] + _ranks(e_src)
+    neighbors[pos], dists[pos] = e_dst, e_dist
+    return Adjacencies(ids, lats, lons, indptr, neighbors, dists, self.radius, self.k)
+
+  def subset(self, rows, k=None):
+    """Neighbor lists of just the orders at rows (e.g. one depot's), keeping only neighbors among them
+    and at most k of those per order"""
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    k = self.k if not k or (self.k and k > self.k) else k
+    if k == self.k and numpy.array_equal(rows, numpy.arange(len(self.ids))):
+      return self
+
+    remap = numpy.full(len(self.ids), -1, dtype=numpy.int64)
+    remap[rows] = numpy.arange(len(rows))
+    indptr = numpy.asarray(self.indptr)
+    counts = indptr[rows + 1] - indptr[rows]
+    src = numpy.repeat(numpy.arange(len(rows)), counts)
+    # position of each entry of the chosen rows in the flat arrays
+    pos = numpy.arange(len(src)) + numpy.repeat(indptr[rows] - (numpy.cumsum(counts) - counts), counts)
+    dst = remap[numpy.asarray(self.neighbors)[pos]]
+    keep = dst >= 0
+    src, dst, dist = src[keep], dst[keep], numpy.asarray(self.dists)[pos][keep]
+    if k:
+      keep = _ranks(src) < k
+      src, dst, dist = src[keep], dst[keep], dist[keep]
+
+    new_indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(src, minlength=len(rows)), out=new_indptr[1:])
+    return Adjacencies([self.ids[i] for i in rows.tolist()], numpy.asarray(self.lats)[rows], numpy.asarray(self.lons)[rows],
+                       new_indptr, dst.astype(numpy.int32), dist.astype(numpy.float32), self.radius, k)
+
+  def with_distances(self, dists):
+    """Same neighbors with new distances (e.g. by road), each row re-ordered nearest first"""
+    rows = numpy.repeat(numpy.arange(len(self.ids)), numpy.diff(self.indptr))
+    order = numpy.lexsort((dists, rows))
+    return Adjacencies(self.ids, self.lats, self.lons, self.indptr, numpy.asarray(self.neighbors)[order],
+                       numpy.asarray(dists, dtype=numpy.float32)[order], self.radius, self.k)
+
+  @staticmethod
+  def fingerprint(ids, lats, lons, radius, k):
+    """Hash of everything the neighbor lists depend on: order IDs, their coordinates, radius and k"""
+    h = hashlib.sha1()
+    h.update(json.dumps([list(ids), radius, k]).encode("utf-8"))
+    h.update(numpy.ascontiguousarray(lats, dtype=numpy.float64).tobytes())
+    h.update(numpy.ascontiguousarray(lons, dtype=numpy.float64).tobytes())
+    return h.hexdigest()
+
+  @classmethod
+  def load(cls, path, key=None):
+    """Memory-map the arrays saved in path, or return None if they're missing or don't match key"""
+    metafile = os.path.join(path, "meta.json")
+    if not os.path.isfile(metafile):
+      return None
+
+    with open(metafile, "r") as f:
+      meta = json.load(f)
+    if key is not None and meta["key"] != key:
+      return None
+
+    with open(os.path.join(path, "ids.json"), "r") as f:
+      ids = json.load(f)
+    arrays = [numpy.load(os.path.join(path, "{}.npy".format(a)), mmap_mode="r") for a in cls.ARRAYS]
+    return cls(ids, *arrays, meta["radius"], meta["k"])
+
+  def save(self, path):
+    if not os.path.exists(path):
+      os.makedirs(path)
+
+    # meta.json is written last and removed first so a half-written cache never looks valid
+    metafile = os.path.join(path, "meta.json")
+    if os.path.isfile(metafile):
+      os.remove(metafile)
+
+    with open(os.path.join(path, "ids.json"), "w") as f:
+      json.dump(self.ids, f)
+    for a in self.ARRAYS:
+      # write next to the old file and swap it in, in case the old one is memory-mapped right now
+      arrayfile = os.path.join(path, "{}.npy".format(a))
+      with open(arrayfile + ".tmp", "wb") as f:
+        numpy.save(f, numpy.ascontiguousarray(getattr(self, a)))
+      os.replace(arrayfile + ".tmp", arrayfile)
+    with open(metafile, "w") as f:
+      json.dump({"key": self.key(), "radius": self.radius, "k": self.k, "orders": len(self.ids)}, f)
+
+  def key(self):
+    return self.fingerprint(self.ids, self.lats, self.lons, self.radius, self.k)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, id):
+    return id in self.index
+
+  def __getitem__(self, id):
+    idx, dists = self.row(self.index[id])
+    return list(zip([self.ids[n] for n in idx.tolist()], dists.tolist()))
+
+  def row(self, i):
+    """Return (neighbor indices, distances) for row i"""
+    start, stop = self.indptr[i], self.indptr[i + 1]
+    return (self.neighbors[start:stop], self.dists[start:stop])
+
+# private methods
+
+def _ranks(rows):
+  """Position of each entry within its run of equal row numbers (rows must be grouped)"""
+  if not len(rows):
+    return numpy.empty(0, dtype=numpy.int64)
+  starts = numpy.flatnonzero(numpy.concatenate(([True], rows[1:] != rows[:-1])))
+  return numpy.arange(len(rows)) - numpy.repeat(starts, numpy.diff(numpy.append(starts, len(rows))))
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+import queue
+
+class BrowserPool:
+  """A fixed set of long-lived headless Firefox sessions shared by any number of screenshot jobs.
+
+  Browsers are started once (in parallel) and handed out one job at a time, so printing N routes
+  costs size browser startups rather than N.
+  """
+  def __init__(self, config, size=None):
+    self.cfg = config
+    self.size = size or self.cfg.browser_processes
+    self.idle = queue.Queue()
+    self.drivers = []
+    with ThreadPoolExecutor(max_workers=self.size) as pool:
+      for driver in pool.map(lambda _: self._start(), range(self.size)):
+        self.drivers.append(driver)
+        self.idle.put(driver)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def screenshot(self, url, filename):
+    """Load url in the next free browser, wait until the page is ready and save a screenshot to filename"""
+    driver = self.idle.get()
+    try:
+      driver.get(url)
+      try:
+        WebDriverWait(driver, self.cfg.screenshot_timeout).until(self._ready)
+      except TimeoutException:
+        print("WARNING: {} wasn't ready after {} seconds, taking the screenshot anyway".format(filename, self.cfg.screenshot_timeout))
+      driver.save_screenshot(filename)
+    finally:
+      self.idle.put(driver)
+
+  def screenshot_many(self, jobs):
+    """Take a screenshot for each (url, filename) job, spread over every browser in the pool"""
+    with ThreadPoolExecutor(max_workers=self.size) as pool:
+      list(pool.map(lambda job: self.screenshot(*job), jobs))
+
+  def close(self):
+    for driver in self.drivers:
+      try:
+        driver.quit()
+      except WebDriverException:
+        pass
+    self.drivers = []
+
+  # private methods
+
+  def _start(self):
+    options = webdriver.FirefoxOptions()
+    options.add_argument("-headless")
+    driver = webdriver.Firefox(options=options)
+    driver.set_window_size(self.cfg.screenshot_width, self.cfg.screenshot_height)
+    return driver
+
+  def _ready(self, driver):
+    # the page has loaded and whatever marks the map as drawn (e.g. the directions panel) is on it
+    return driver.execute_script("return document.readyState == 'complete' && document.querySelector(arguments[0]) != null;",
+                                 self.cfg.screenshot_ready_selector)
@@ -0,0 +1,25 @@
+import importlib
+import argparse
+
+# subcommand: (script module, what it does); a script is only imported once its subcommand is picked
+COMMANDS = {
+  "route": ("router", "calculate delivery routes from a Shopify orders CSV"),
+  "regen": ("regen", "rebuild the routes file from a hand-edited routes.csv"),
+  "print": ("printer", "print a PDF for each route"),
+  "kml": ("gen_kml", "write a KML (or KMZ) map of the deliveries and the master list"),
+  "export": ("export", "write any of the CSV/KML/GeoJSON outputs in one pass"),
+  "sweep": ("sweep", "route with every combination of routing parameters and keep the best"),
+  "serve": ("serve", "keep the orders and routes loaded and change them over HTTP/JSON"),
+}
+
+def main(argv=None):
+  commands = "\n".join("  {:<8} {}".format(name, about) for name, (_, about) in COMMANDS.items())
+  parser = argparse.ArgumentParser(prog="delivery-routes", description='Plan, print and export delivery routes.',
+                                   epilog="commands:\n{}\n\nRun 'delivery-routes <command> -h' for the options of a command.".format(commands),
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('command', choices=list(COMMANDS), metavar='command', help='one of the commands below')
+  parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  (module, _) = COMMANDS[args.command]
+  return importlib.import_module(module).main(args.args, "delivery-routes {}".format(args.command))
@@ -10,8 +10,46 @@ class Config:
                    { "type": "26' Flatbed", "capacity": 315 }] # 7 skids / 315 bags
     self.contact = "(123) 456-7890 (John Smith)"
     self.output_dir = "output"
+    self.file_format = "json"       # "ndjson" writes orders/routes one per line, indexed for random access
     self.processes = 8
+    self.neighbor_radius = 3        # miles, how far to look for orders to add to a route
+    self.max_neighbors = 200        # nearest orders kept per order within the neighbor radius
+    self.solver = "greedy"          # routing engine, see lib/solvers.py
+    self.seed = None                # shuffles the greedy solver's start order a little, for trying several variations
+    self.consolidate = False        # merge nearby underfilled routes after routing, see lib/consolidate.py
+    self.consolidate_truck = None   # biggest truck a merged route may need (None keeps to the first in trucks)
+    self.sweep_kmeans = 0           # k-means rounds the sweep solver runs to tighten its routes
+    self.distance_provider = "haversine" # or "google"/"file" to route on road distances, see lib/road_distance.py
+    self.distance_matrix_file = None # CSV of precomputed road distances for the "file" provider
+    self.distance_cache = "road_distances.db" # SQLite cache of road distances shared across runs and seasons
+    self.distance_base_url = None   # send distance matrix requests to another server (e.g. a local stand-in)
+    self.road_neighbors = 25        # nearest candidates per order to get road distances for
+    self.sequence = False           # reorder each route's stops (2-opt/Or-opt) before saving
+    self.sequence_time_budget = 1.0 # seconds spent sequencing any one route
     self.origin = [38.950633, -77.397684]
+    self.depots = []                # several lots to load at, e.g. [{"name": "North", "location": [lat, lon]}] (empty uses origin)
+    self.depot_sectors = 1          # angular sectors each depot's orders are split into, each routed on its own
+    self.kml_lines = True           # draw a line through each route's stops in deliveries.kml/.kmz
+    self.map_renderer = "static"    # "static" draws route maps offline, "browser" screenshots Google Maps
+    self.map_width = 960
+    self.map_height = 640
+    self.tile_cache_dir = None      # local {zoom}/{x}/{y}.png map tiles used as a basemap by the static renderer
+    self.browser_processes = 3      # headless browsers taking map screenshots (separate from processes)
+    self.screenshot_timeout = 20    # seconds to wait for a map page to be ready
+    self.screenshot_ready_selector = "div[id^='section-directions-trip']" # present once directions are drawn
+    self.screenshot_width = 1440
+    self.screenshot_height = 900
+    self.geocode_base_url = None    # send geocoding requests to another server (e.g. a local stub)
+    self.geocode_workers = 8        # concurrent Google geocoding requests
+    self.geocode_rate = 25          # most Google geocoding requests per second
+    self.geocode_retries = 3
+    self.geocode_backoff = 0.5      # seconds before the first retry, doubled for each one after
+    self.geocode_cache = "geocodes.db" # SQLite geocode cache shared across runs and seasons (None disables it)
+    self.geocode_ttl_days = 730     # geocodes older than this are looked up again
+    self.geocode_cache_size = None  # most addresses kept in the geocode cache (None for no limit)
+    self.service_host = "127.0.0.1" # where serve.py listens
+    self.service_port = 8080
+    self.service_snapshot_interval = 2.0 # seconds between writing the service's changes to the output directory
     self.mappings = {}
     self.verbose = None
 
@@ -46,6 +84,18 @@ class Config:
       self.contact = os.environ["CONTACT"]
     except KeyError:
       pass
+    try:
+      self.geocode_base_url = os.environ["GEOCODE_BASE_URL"]
+    except KeyError:
+      pass
+    try:
+      self.geocode_cache = os.environ["GEOCODE_CACHE"]
+    except KeyError:
+      pass
+    try:
+      self.distance_base_url = os.environ["DISTANCE_BASE_URL"]
+    except KeyError:
+      pass
 
   def _setup_mappings(self):
     self.mappings = { 
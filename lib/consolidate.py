@@ -0,0 +1,197 @@
+import heapq
+import numpy
+
+from lib import distance
+from lib import metrics
+from lib.export import truck_type
+from lib.spatial import GridIndex
+
+# nearby routes (nearest first, with centers within Config.neighbor_radius) each route may be merged with
+NEIGHBORS = 25
+
+class Consolidator:
+  """Packs routes (lists of order IDs) onto fewer trucks after routing.
+
+  A move only counts when the trucks the routes need hold fewer bags between them afterwards, which
+  is also what raises the fleet's utilization. Pairs of nearby routes (by the distance between their
+  centers, from the same depot) that fit on one truck that small wait in a priority queue, fullest
+  combined load first and closest first among equal loads, and are merged in that order. Once no pair
+  is left, routes are rebalanced: the emptiest routes are dissolved when each of their stops fits in
+  the space left on a nearby route's truck. Both repeat until no improving move remains.
+  """
+  def __init__(self, calc, routes, capacity):
+    self.cfg = calc.cfg
+    self.data = calc.data
+    self.capacity = capacity
+    self.stops = {}
+    self.loads = {}
+    self.centers = {}
+    self.depots = {}
+    self.versions = {}
+    self.neighbors = {}
+    self.heap = []
+    for route in routes:
+      self._add(list(self.data.rows(route)))
+
+    # the routes whose centers are near each route, found through a grid over the centers
+    ids = [r for r in self.stops if not numpy.isnan(self.centers[r][0])]
+    lats = numpy.array([self.centers[r][0] for r in ids], dtype=numpy.float64)
+    lons = numpy.array([self.centers[r][1] for r in ids], dtype=numpy.float64)
+    grid = GridIndex(lats, lons, self.cfg.neighbor_radius)
+    for a in ids:
+      self.neighbors[a] = set()
+    for i, a in enumerate(ids):
+      found, _ = grid.query(lats[i], lons[i], self.cfg.neighbor_radius, NEIGHBORS + 1, exclude=i)
+      for j in found.tolist():
+        b = ids[j]
+        if self.depots[a] == self.depots[b]:
+          self.neighbors[a].add(b)
+          self.neighbors[b].add(a)
+    for a in ids:
+      self._push_pairs(a)
+
+  def run(self):
+    """Merge and rebalance until no move removes a route, returning the routes (farthest first)"""
+    while self.merge() + self.rebalance():
+      pass
+    routes = sorted(self.stops.values(), key=lambda rows: -numpy.nan_to_num(self.data.origin_dist[rows], nan=numpy.inf).max())
+    return [[self.data.ids[i] for i in rows] for rows in routes]
+
+  def merge(self):
+    """Merge queued pairs of routes (fullest combined load first) while they still fit; returns how many"""
+    merged = 0
+    while self.heap:
+      (_, _, a, b, version_a, version_b) = heapq.heappop(self.heap)
+      # either route may have been merged or changed since the pair was queued
+      if self.versions.get(a) != version_a or self.versions.get(b) != version_b:
+        continue
+      m = self._add(self.stops[a] + self.stops[b])
+      nearby = (self.neighbors[a] | self.neighbors[b]) - {a, b}
+      self._remove(a)
+      self._remove(b)
+      self._connect(m, nearby)
+      merged += 1
+    return merged
+
+  def rebalance(self):
+    """Dissolve the emptiest routes whose stops all fit on nearby routes; returns how many"""
+    dissolved = 0
+    for r in sorted(self.stops, key=lambda r: self.loads[r]):
+      if r not in self.stops or r not in self.neighbors:
+        continue
+      # only the space already on each truck, so no route moves up to a bigger one
+      room = {n: self._truck(self.loads[n]) - self.loads[n] for n in self.neighbors[r]}
+      if sum(room.values()) < self.loads[r]:
+        continue
+
+      # the biggest stops first, each onto the route with room whose center is nearest to it
+      moves = []
+      for i in sorted(self.stops[r], key=lambda i: -int(self.data.count[i])):
+        c = int(self.data.count[i])
+        fits = [n for n, left in room.items() if left >= c]
+        if not fits or numpy.isnan(self.data.lat[i]):
+          moves = None
+          break
+        dists = distance.haversine(self.data.lat[i], self.data.lon[i], [self.centers[n][0] for n in fits], [self.centers[n][1] for n in fits])
+        n = fits[int(numpy.argmin(dists))]
+        room[n] -= c
+        moves.append((i, n))
+      if moves is None:
+        continue
+
+      targets = {}
+      for (i, n) in moves:
+        targets.setdefault(n, []).append(i)
+      nearby = self.neighbors[r] - {r}
+      self._remove(r)
+      for n, rows in targets.items():
+        m = self._add(self.stops[n] + rows)
+        nearby |= self.neighbors[n]
+        self._remove(n)
+        self._connect(m, nearby - set(targets))
+      dissolved += 1
+    return dissolved
+
+  # private methods
+
+  def _add(self, rows):
+    r = len(self.versions)
+    self.stops[r] = rows
+    self.loads[r] = int(self.data.count[rows].sum())
+    lats, lons = self.data.lat[rows], self.data.lon[rows]
+    located = ~numpy.isnan(lats) & ~numpy.isnan(lons)
+    self.centers[r] = (lats[located].mean(), lons[located].mean()) if located.any() else (numpy.nan, numpy.nan)
+    self.depots[r] = self.data.depots[rows[0]]
+    self.versions[r] = r
+    return r
+
+  def _remove(self, r):
+    for n in self.neighbors.pop(r, ()):
+      if n in self.neighbors:
+        self.neighbors[n].discard(r)
+    del self.stops[r]
+    del self.loads[r]
+    # leaves a version that no queued pair can match
+    self.versions[r] = -1
+
+  def _connect(self, m, nearby):
+    """Link a new route m to the routes near it and queue the pairs that fit"""
+    self.neighbors[m] = set()
+    if numpy.isnan(self.centers[m][0]):
+      return
+    for n in nearby:
+      if n not in self.stops or self.depots[n] != self.depots[m] or numpy.isnan(self.centers[n][0]):
+        continue
+      if self._distance(m, n) <= self.cfg.neighbor_radius:
+        self.neighbors[m].add(n)
+        self.neighbors[n].add(m)
+    self._push_pairs(m)
+
+  def _push_pairs(self, a):
+    for b in self.neighbors[a]:
+      combined = self.loads[a] + self.loads[b]
+      if combined <= self.capacity and self._truck(combined) < self._truck(self.loads[a]) + self._truck(self.loads[b]):
+        heapq.heappush(self.heap, (-combined, self._distance(a, b), a, b, self.versions[a], self.versions[b]))
+
+  def _truck(self, load):
+    """Capacity of the truck a route of load bags needs (the load itself when no truck is big enough)"""
+    return max(self.cfg.truck_capacity(truck_type(self.cfg, load)), load)
+
+  def _distance(self, a, b):
+    return float(distance.haversine(self.centers[a][0], self.centers[a][1], self.centers[b][0], self.centers[b][1]))
+
+def consolidate(calc, routes):
+  """Merge and rebalance nearby underfilled routes (lists of order IDs) up to the capacity of
+  Config.consolidate_truck, printing the fleet's utilization before and after when verbose"""
+  cfg = calc.cfg
+  capacity = merge_capacity(cfg)
+  before = [int(calc.data.count[calc.data.rows(route)].sum()) for route in routes]
+
+  with metrics.stage("consolidate"):
+    consolidated = Consolidator(calc, routes, capacity).run()
+
+  after = [int(calc.data.count[calc.data.rows(route)].sum()) for route in consolidated]
+  metrics.count("routes_consolidated", len(routes) - len(consolidated))
+  if cfg.verbose:
+    print("Consolidated {} routes into {} ({:.1%} of the trucks' capacity used, was {:.1%})".format(
+          len(routes), len(consolidated), utilization(cfg, after), utilization(cfg, before)))
+  return consolidated
+
+def merge_capacity(config):
+  """Most bags a merged route may hold: Config.consolidate_truck's capacity, or the first truck's"""
+  if config.consolidate_truck is None:
+    return int(config.trucks[0]["capacity"])
+  capacity = config.truck_capacity(config.consolidate_truck)
+  if capacity < 0:
+    raise ValueError("Unknown truck '{}' (choose from {})".format(config.consolidate_truck, ", ".join(t["type"] for t in config.trucks)))
+  return int(capacity)
+
+def utilization(config, loads):
+  """Share of the fleet's capacity in use: the bags over the capacity of the truck each route needs
+  (a route too big for any truck counts as exactly full)"""
+  capacity = sum(max(config.truck_capacity(truck_type(config, load)), load) for load in loads)
+  return sum(loads) / capacity if capacity else 0.0
+
+def unused_space(config, loads):
+  """Bags of room left over on the trucks the routes need"""
+  return sum(max(config.truck_capacity(truck_type(config, load)) - load, 0) for load in loads)
@@ -0,0 +1,87 @@
+import math
+import numpy
+
+from lib import distance
+from lib.spatial import GridIndex
+
+# depots are miles apart, so a coarse grid keeps their index small
+CELL_MILES = 5.0
+
+def depot_list(config):
+  """[(name, lat, lon)] of every depot: Config.depots, or just Config.origin (named None) without any"""
+  if config.depots:
+    return [(d["name"], float(d["location"][0]), float(d["location"][1])) for d in config.depots]
+  return [(None, float(config.origin[0]), float(config.origin[1]))]
+
+def location(config, name):
+  """[lat, lon] of the named depot (Config.origin for orders without one)"""
+  for (depot, lat, lon) in depot_list(config):
+    if depot == name:
+      return [lat, lon]
+  return list(config.origin)
+
+def assign(config, lats, lons):
+  """(names, distances): the nearest depot to each point and how far away it is.
+
+  Points that failed to geocode (NaN) get no depot and a NaN distance.
+  """
+  depots = depot_list(config)
+  lats = numpy.asarray(lats, dtype=numpy.float64)
+  lons = numpy.asarray(lons, dtype=numpy.float64)
+  names = [None] * len(lats)
+  dists = numpy.full(len(lats), numpy.nan)
+  located = numpy.flatnonzero(~numpy.isnan(lats) & ~numpy.isnan(lons))
+  if len(depots) == 1:
+    (name, lat, lon) = depots[0]
+    dists[located] = distance.haversine(lat, lon, lats[located], lons[located])
+    for i in located.tolist():
+      names[i] = name
+    return (names, dists)
+
+  index = GridIndex([d[1] for d in depots], [d[2] for d in depots], CELL_MILES)
+  (nearest, nearest_dists) = index.nearest_many(lats[located], lons[located])
+  dists[located] = nearest_dists
+  for i, d in zip(located.tolist(), nearest.tolist()):
+    names[i] = depots[d][0]
+  return (names, dists)
+
+def polar_order(lat, lon, lats, lons, dists=None):
+  """Indices of the points in order of their angle around lat/lon (nearest first at the same angle,
+  given their dists), starting just past the widest empty wedge so no neighborhood is cut in two"""
+  lats = numpy.asarray(lats, dtype=numpy.float64)
+  lons = numpy.asarray(lons, dtype=numpy.float64)
+  if len(lats) == 0:
+    return numpy.empty(0, dtype=numpy.int64)
+  angles = numpy.arctan2(lats - lat, (lons - lon) * math.cos(math.radians(lat)))
+  order = numpy.lexsort((dists, angles)) if dists is not None else numpy.argsort(angles, kind="stable")
+  gaps = numpy.diff(numpy.concatenate((angles[order], [angles[order[0]] + 2 * math.pi])))
+  return numpy.roll(order, -(int(numpy.argmax(gaps)) + 1))
+
+def sectors(lat, lon, lats, lons, n):
+  """Split the points around a depot into n angular sectors of about the same number of orders each,
+  returning each point's sector (0 to n-1)"""
+  if n <= 1 or len(lats) == 0:
+    return numpy.zeros(len(lats), dtype=numpy.int64)
+  order = polar_order(lat, lon, lats, lons)
+  sector = numpy.empty(len(lats), dtype=numpy.int64)
+  sector[order] = numpy.arange(len(lats)) * n // len(lats)
+  return sector
+
+def partitions(config, orders):
+  """[(depot name, sector, rows)]: the orders of an OrderTable grouped by depot and then by
+  Config.depot_sectors angular sectors around it, in Config.depots order"""
+  groups = []
+  for (name, lat, lon) in depot_list(config):
+    rows = numpy.array([i for i, depot in enumerate(orders.depots) if depot == name], dtype=numpy.int64)
+    if not len(rows):
+      continue
+    sector = sectors(lat, lon, orders.lat[rows], orders.lon[rows], config.depot_sectors)
+    for s in range(max(config.depot_sectors, 1)):
+      part = rows[sector == s]
+      if len(part):
+        groups.append((name, s, part))
+  # orders that couldn't be placed near any depot are routed on their own
+  unplaced = numpy.array([i for i, depot in enumerate(orders.depots) if depot is None], dtype=numpy.int64)
+  if len(unplaced) and config.depots:
+    groups.append((None, 0, unplaced))
+  return groups
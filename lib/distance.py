@@ -0,0 +1,31 @@
+import numpy
+
+from lib import metrics
+
+# Same mean earth radius (and kilometer/mile conversion) geopy's great_circle uses so
+# that distances computed here line up with the ones stored in orders.json
+EARTH_RADIUS_MILES = 6371.009 / 1.609344
+
+def to_radians(lats, lons):
+  return (numpy.radians(numpy.asarray(lats, dtype=numpy.float64)),
+          numpy.radians(numpy.asarray(lons, dtype=numpy.float64)))
+
+def haversine(lat1, lon1, lat2, lon2):
+  """Great-circle distance (in miles) between points given in degrees, broadcasting like numpy"""
+  lat1, lon1 = to_radians(lat1, lon1)
+  lat2, lon2 = to_radians(lat2, lon2)
+  return _haversine_radians(lat1, lon1, lat2, lon2)
+
+def distance_matrix(lats, lons, lats2=None, lons2=None):
+  """Full matrix of distances (in miles) from every (lats, lons) point to every (lats2, lons2) point"""
+  rlat, rlon = to_radians(lats, lons)
+  if lats2 is None:
+    clat, clon = rlat, rlon
+  else:
+    clat, clon = to_radians(lats2, lons2)
+  metrics.count("distance_pairs", len(rlat) * len(clat))
+  return _haversine_radians(rlat[:, None], rlon[:, None], clat[None, :], clon[None, :])
+
+def _haversine_radians(lat1, lon1, lat2, lon2):
+  a = numpy.sin((lat2 - lat1) / 2.0) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2.0) ** 2
+  return 2.0 * EARTH_RADIUS_MILES * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0.0, 1.0)))
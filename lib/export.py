@@ -0,0 +1,263 @@
+from threading import Thread
+
+import colorsys
+import zipfile
+import queue
+import json
+import csv
+import io
+
+from lib import metrics
+
+GOLDEN_RATIO = 0.6180339887498949
+
+class RouteSummary:
+  """Per-route totals worked out once and shared by every writer"""
+  __slots__ = ("number", "name", "bags", "stops", "truck", "ids", "depot")
+
+  def __init__(self, config, number, route):
+    self.number = number
+    self.name = "route-{}".format(number)
+    self.ids = [d['id'] for d in route]
+    self.bags = sum(int(d['count']) for d in route)
+    self.stops = len(route)
+    self.truck = truck_type(config, self.bags)
+    # every order on a route is delivered from the same depot (None with just Config.origin)
+    self.depot = route[0].get('depot') if route else None
+
+class Writer:
+  """One export output: opened once, handed each route (with its summary) in order, then closed"""
+  name = None
+  filename = None
+
+  def __init__(self, config):
+    self.cfg = config
+    self.savefile = "{}/{}".format(config.output_dir, self.filename)
+    self.routes = 0
+
+  def open(self):
+    pass
+
+  def write(self, summary, route):
+    raise NotImplementedError
+
+  def close(self):
+    if self.cfg.verbose:
+      print("Saved {} routes to {}".format(self.routes, self.savefile))
+
+class CsvWriter(Writer):
+  header = None
+
+  def open(self):
+    self.file = open(self.savefile, "w")
+    self.csv = csv.writer(self.file)
+    # Write CSV Header, If you dont need that, remove this line
+    self.csv.writerow(self.header)
+
+  def close(self):
+    self.file.close()
+    super().close()
+
+class OrdersCsvWriter(CsvWriter):
+  """orders.csv: one row per order with the route it's on"""
+  name = "orders"
+  filename = "orders.csv"
+  header = ["ID", "Route", "Name", "Address", "Bag Count", "Comments"]
+
+  def write(self, summary, route):
+    for d in route:
+      self.csv.writerow([d['id'], summary.name, d['name'], d['address'], d['count'], d['comments']])
+    self.routes += 1
+
+class RoutesCsvWriter(CsvWriter):
+  """routes.csv: one row per route, the file hand edits are made in before running regen.py"""
+  name = "routes"
+  filename = "routes.csv"
+  header = ["Route", "Bag Count", "Deliveries", "Stops", "Depot", "Driver", "Time Out", "Time In", "Duration"]
+
+  def write(self, summary, route):
+    self.csv.writerow([summary.name, summary.bags, ";".join(summary.ids), summary.stops, summary.depot or "", "", "", "", ""])
+    self.routes += 1
+
+class MasterCsvWriter(CsvWriter):
+  """master.csv: the order list used for tracking deliveries on the day"""
+  name = "master"
+  filename = "master.csv"
+  header = ["ID", "Name", "Address", "Bags", "Route", "Coments"]
+
+  def write(self, summary, route):
+    for d in route:
+      self.csv.writerow([d['id'], d['name'], d['address'], d['count'], summary.name, d['comments']])
+    self.routes += 1
+
+class KmlWriter(Writer):
+  """deliveries.kml for Google My Maps: a folder per route holding a point per delivery (and, with
+  Config.kml_lines, a line through the stops in order), all sharing one style per route.
+
+  The document is written out as the routes come in rather than built up in memory.
+  """
+  name = "kml"
+  filename = "deliveries.kml"
+
+  def open(self):
+    self.file = open(self.savefile, "w", encoding="utf-8")
+    self._start()
+
+  def write(self, summary, route):
+    color = route_color(summary.number)
+    f = self.file
+    f.write('<Style id="{0}"><IconStyle><color>{1}</color></IconStyle>'
+            '<LineStyle><color>{1}</color><width>3</width></LineStyle></Style>\n'.format(summary.name, color))
+    f.write("<Folder><name>{}</name><description>{} stops, {} bags ({})</description>\n".format(
+            summary.name, summary.stops, summary.bags, _escape(summary.truck)))
+    coords = []
+    for delivery in route:
+      if not _located(delivery):
+        continue
+      coord = "{},{}".format(delivery['lon'], delivery['lat'])
+      coords.append(coord)
+      f.write("<Placemark><name>{}</name><description>{}</description><styleUrl>#{}</styleUrl>"
+              "<Point><coordinates>{}</coordinates></Point></Placemark>\n".format(
+              _escape("{} {} ({} bags)".format(delivery['id'], delivery['address'], delivery['count'])),
+              summary.name, summary.name, coord))
+      self.points += 1
+    if self.cfg.kml_lines and len(coords) > 1:
+      f.write("<Placemark><name>{0}</name><styleUrl>#{0}</styleUrl><LineString><tessellate>1</tessellate>"
+              "<coordinates>{1}</coordinates></LineString></Placemark>\n".format(summary.name, " ".join(coords)))
+    f.write("</Folder>\n")
+    self.routes += 1
+
+  def close(self):
+    self.file.write("</Document>\n</kml>\n")
+    self.file.close()
+    if self.cfg.verbose:
+      print("Created {} points, one per order.".format(self.points))
+    super().close()
+
+  def _start(self):
+    self.points = 0
+    self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+                    '<Document><name>Deliveries</name><open>1</open>\n')
+
+class KmzWriter(KmlWriter):
+  """deliveries.kmz: the same document as deliveries.kml, compressed as it's written"""
+  name = "kmz"
+  filename = "deliveries.kmz"
+
+  def open(self):
+    self.zip = zipfile.ZipFile(self.savefile, "w", compression=zipfile.ZIP_DEFLATED)
+    self.file = io.TextIOWrapper(self.zip.open("doc.kml", "w"), encoding="utf-8")
+    self._start()
+
+  def close(self):
+    super().close()
+    self.zip.close()
+
+class GeoJsonWriter(Writer):
+  """deliveries.geojson: a point per delivery and a line through each route's stops, streamed feature by feature"""
+  name = "geojson"
+  filename = "deliveries.geojson"
+
+  def open(self):
+    self.file = open(self.savefile, "w")
+    self.file.write('{"type":"FeatureCollection","features":[\n')
+    self.first = True
+
+  def write(self, summary, route):
+    # orders that never geocoded have no place on the map (a line needs two points)
+    coords = [[d['lon'], d['lat']] for d in route if _located(d)]
+    if len(coords) > 1:
+      self._feature({"type": "LineString", "coordinates": coords},
+                    {"route": summary.name, "bags": summary.bags, "stops": summary.stops, "truck": summary.truck, "depot": summary.depot})
+    for stop, d in enumerate(route):
+      if not _located(d):
+        continue
+      self._feature({"type": "Point", "coordinates": [d['lon'], d['lat']]},
+                    {"id": d['id'], "name": d['name'], "address": d['address'], "count": d['count'],
+                     "comments": d['comments'], "route": summary.name, "stop": stop + 1})
+    self.routes += 1
+
+  def close(self):
+    self.file.write("\n]}\n")
+    self.file.close()
+    super().close()
+
+  def _feature(self, geometry, properties):
+    if not self.first:
+      self.file.write(",\n")
+    self.first = False
+    self.file.write(json.dumps({"type": "Feature", "geometry": geometry, "properties": properties}, separators=(",", ":")))
+
+WRITERS = { w.name: w for w in (OrdersCsvWriter, RoutesCsvWriter, MasterCsvWriter, KmlWriter, KmzWriter, GeoJsonWriter) }
+
+def export_routes(config, routes, outputs):
+  """Walk routes once, feeding every requested output (see WRITERS) from its own thread.
+
+  routes can be any iterable of routes, e.g. a streamed routes.ndjson. Returns the RouteSummary of each route.
+  """
+  writers = [WRITERS[name](config) for name in outputs]
+  queues = [queue.Queue(maxsize=64) for _ in writers]
+  errors = []
+  threads = [Thread(target=_run_writer, args=(w, q, errors)) for w, q in zip(writers, queues)]
+  for t in threads:
+    t.start()
+
+  summaries = []
+  with metrics.stage("export"):
+    try:
+      for idx, route in enumerate(routes):
+        summary = RouteSummary(config, idx+1, route)
+        summaries.append(summary)
+        for q in queues:
+          q.put((summary, route))
+    finally:
+      # even when reading a route fails, so the writer threads finish and the process can exit
+      for q in queues:
+        q.put(None)
+      for t in threads:
+        t.join()
+
+  if errors:
+    raise errors[0]
+  return summaries
+
+def truck_type(config, count):
+  for t in config.trucks:
+    if count <= int(t['capacity']):
+      return t['type']
+  return "!INVALID!"
+
+def route_color(number):
+  """KML (aabbggrr) color for a route: hues spaced by the golden ratio so neighboring route numbers
+  stand apart, for any number of routes, and the same route always gets the same color"""
+  hue = (number * GOLDEN_RATIO) % 1.0
+  r, g, b = colorsys.hls_to_rgb(hue, 0.5, 0.95)
+  return "ff{:02x}{:02x}{:02x}".format(round(b * 255), round(g * 255), round(r * 255))
+
+# private methods
+
+def _escape(text):
+  # xml.sax.saxutils.escape, without pulling in urllib along with it
+  return str(text).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _located(delivery):
+  lat = delivery['lat']
+  # orders that never geocoded are None in the JSON files, NaN in an OrderTable
+  return lat is not None and lat == lat
+
+def _run_writer(writer, q, errors):
+  done = False
+  try:
+    writer.open()
+    while not done:
+      item = q.get()
+      done = item is None
+      if not done:
+        writer.write(*item)
+    writer.close()
+  except Exception as err:
+    errors.append(err)
+    # keep draining so the producer never blocks on a full queue
+    while not done:
+      done = q.get() is None
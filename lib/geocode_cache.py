@@ -0,0 +1,75 @@
+import re
+import sqlite3
+import time
+
+class GeocodeCache:
+  """Address-keyed geocode results kept in SQLite, so a house is only ever geocoded once across runs and seasons.
+
+  Entries older than ttl_days are ignored and evicted; with max_entries set, the oldest entries
+  beyond that count are evicted as well.
+  """
+  # SQLite's default limit on the number of ? parameters in one statement is 999
+  CHUNK = 500
+
+  def __init__(self, path, ttl_days=None, max_entries=None):
+    self.path = path
+    self.ttl = ttl_days * 86400 if ttl_days else None
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    # the service geocodes from whichever thread handles the request; its lock keeps the use one at a time
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute("""CREATE TABLE IF NOT EXISTS geocodes (
+                         key TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL,
+                         provider TEXT, created REAL NOT NULL)""")
+    self.db.execute("CREATE INDEX IF NOT EXISTS geocodes_created ON geocodes (created)")
+    self.db.commit()
+
+  @staticmethod
+  def normalize(street, city, state, zipc):
+    """Cache key for an address: upper case, punctuation dropped, whitespace collapsed, 5-digit zip"""
+    parts = []
+    for part in (street, city, state):
+      parts.append(" ".join(re.sub(r"[^\w\s]", " ", part or "").upper().split()))
+    parts.append(re.sub(r"[^\d]", "", zipc or "")[:5])
+    return "|".join(parts)
+
+  def get_many(self, keys):
+    """Return {key: (lat, lon)} for each of keys found (and not expired) in the cache"""
+    found = {}
+    keys = list(set(keys))
+    oldest = time.time() - self.ttl if self.ttl else 0
+
+    for start in range(0, len(keys), self.CHUNK):
+      chunk = keys[start:start + self.CHUNK]
+      rows = self.db.execute("SELECT key, lat, lon FROM geocodes WHERE created >= ? AND key IN ({})".format(",".join("?" * len(chunk))),
+                             [oldest] + chunk)
+      for (key, lat, lon) in rows:
+        found[key] = (lat, lon)
+
+    return found
+
+  def put_many(self, entries, provider):
+    """Store (key, lat, lon) entries geocoded by provider"""
+    now = time.time()
+    self.db.executemany("INSERT OR REPLACE INTO geocodes (key, lat, lon, provider, created) VALUES (?, ?, ?, ?, ?)",
+                        [(key, lat, lon, provider, now) for (key, lat, lon) in entries])
+    self.db.commit()
+
+  def evict(self):
+    """Drop expired entries, then the oldest ones beyond max_entries; returns how many were dropped"""
+    dropped = 0
+    if self.ttl:
+      dropped += self.db.execute("DELETE FROM geocodes WHERE created < ?", (time.time() - self.ttl,)).rowcount
+    if self.max_entries:
+      dropped += self.db.execute("""DELETE FROM geocodes WHERE key IN
+                                      (SELECT key FROM geocodes ORDER BY created DESC LIMIT -1 OFFSET ?)""",
+                                 (self.max_entries,)).rowcount
+    self.db.commit()
+    return dropped
+
+  def __len__(self):
+    return self.db.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+  def close(self):
+    self.db.close()
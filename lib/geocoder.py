@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import time
+
+from lib import metrics
+from lib.geocode_cache import GeocodeCache
+
+class RateLimiter:
+  """Spaces out calls (from any number of threads) to at most rate per second"""
+  def __init__(self, rate):
+    self.interval = 1.0 / rate if rate else 0.0
+    self.next_slot = 0.0
+    self.lock = threading.Lock()
+
+  def wait(self):
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+class Geocoder:
+  """Geocodes addresses with SmartyStreets (in batches of up to 100) or Google (concurrently, rate limited).
+
+  Config.geocode_base_url points either client at another server, e.g. a local stub for testing.
+  Results are kept in the SQLite cache at Config.geocode_cache, which is checked before any request.
+  The API clients (and their libraries) are only loaded once an address actually has to be looked up.
+  """
+  def __init__(self, config):
+    self.cfg = config
+    self._google_client = None
+    self._smarty_client = None
+    self.limiter = RateLimiter(self.cfg.geocode_rate)
+    self.cache = None
+    if self.cfg.geocode_cache:
+      self.cache = GeocodeCache(self.cfg.geocode_cache, self.cfg.geocode_ttl_days, self.cfg.geocode_cache_size)
+      self.cache.evict()
+
+  def geocode(self, street, city, state, zipc):
+    return self.geocode_many([(street, city, state, zipc)])[0]
+
+  def geocode_many(self, addresses):
+    """Geocode a list of (street, city, state, zip) tuples, returning a (lat, lon) tuple for each"""
+    if not addresses:
+      return []
+    if self.cache is None:
+      return self._lookup(addresses)
+
+    keys = [GeocodeCache.normalize(*address) for address in addresses]
+    cached = self.cache.get_many(keys)
+
+    # only the distinct addresses the cache doesn't know go out over the network
+    missing = {}
+    for key, address in zip(keys, addresses):
+      if key not in cached and key not in missing:
+        missing[key] = address
+    self.cache.hits += len(keys) - len(missing)
+    self.cache.misses += len(missing)
+    metrics.count("geocode_cache_hits", len(keys) - len(missing))
+    metrics.count("geocode_cache_misses", len(missing))
+    if self.cfg.verbose:
+      print("Geocode cache: {} hits, {} misses".format(len(keys) - len(missing), len(missing)))
+
+    fetched = dict(zip(missing.keys(), self._lookup(list(missing.values())))) if missing else {}
+    # failed lookups come back as (None,None) or (0,0) and are not worth remembering
+    self.cache.put_many([(key, lat, lon) for key, (lat, lon) in fetched.items() if lat and lon], self.provider())
+
+    cached.update(fetched)
+    return [cached[key] for key in keys]
+
+  def provider(self):
+    if self.cfg.smarty_auth_id:
+      return "smartystreets"
+    elif self.cfg.google_api_key:
+      return "google"
+    return None
+
+  @property
+  def google_client(self):
+    if self._google_client is None and self.cfg.google_api_key:
+      import googlemaps
+      if self.cfg.geocode_base_url:
+        self._google_client = googlemaps.Client(self.cfg.google_api_key, base_url=self.cfg.geocode_base_url)
+      else:
+        self._google_client = googlemaps.Client(self.cfg.google_api_key)
+    return self._google_client
+
+  @property
+  def smarty_client(self):
+    if self._smarty_client is None and self.cfg.smarty_auth_id:
+      import smartystreets_python_sdk
+      credentials = smartystreets_python_sdk.StaticCredentials(self.cfg.smarty_auth_id, self.cfg.smarty_auth_token)
+      builder = smartystreets_python_sdk.ClientBuilder(credentials)
+      if self.cfg.geocode_base_url:
+        builder = builder.with_base_url(self.cfg.geocode_base_url)
+      self._smarty_client = builder.build_us_street_api_client()
+    return self._smarty_client
+
+  # private methods
+
+  def _lookup(self, addresses):
+    if self.provider():
+      metrics.count("geocode_calls", len(addresses))
+    if self.smarty_client:
+      import smartystreets_python_sdk
+      if self.cfg.verbose:
+        print("Geocoding {} addresses with SmartyStreets".format(len(addresses)))
+      size = smartystreets_python_sdk.Batch.MAX_BATCH_SIZE
+      results = []
+      for start in range(0, len(addresses), size):
+        results.extend(self._smarty_batch(addresses[start:start + size]))
+      return results
+    elif self.google_client:
+      if self.cfg.verbose:
+        print("Geocoding {} addresses with Google".format(len(addresses)))
+      with ThreadPoolExecutor(max_workers=self.cfg.geocode_workers) as pool:
+        return list(pool.map(self._google_one, addresses))
+    return [(0,0)] * len(addresses)
+
+  def _smarty_batch(self, addresses):
+    import smartystreets_python_sdk
+    batch = smartystreets_python_sdk.Batch()
+    for (street, city, state, zipc) in addresses:
+      lookup = smartystreets_python_sdk.us_street.Lookup()
+      lookup.street = street
+      lookup.city = city
+      lookup.state = state
+      #lookup.zip = zipc
+      batch.add(lookup)
+
+    try:
+      self._retry(lambda: self.smarty_client.send_batch(batch), smartystreets_python_sdk.exceptions.SmartyException)
+    except smartystreets_python_sdk.exceptions.SmartyException as err:
+      print(err)
+      return [(0,0)] * len(addresses)
+
+    results = []
+    for address, lookup in zip(addresses, batch):
+      if not lookup.result:
+        print("ERROR: Cannot geocode {}: invalid!".format(self._format(address)))
+        results.append((None,None))
+      else:
+        results.append((lookup.result[0].metadata.latitude, lookup.result[0].metadata.longitude))
+    return results
+
+  def _google_one(self, address):
+    import googlemaps
+    addr = self._format(address)
+    if self.cfg.verbose:
+      print("Geocoding '{}' with Google".format(addr))
+
+    try:
+      geo_result = self._retry(lambda: self._google_request(addr),
+                               (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout, googlemaps.exceptions.ApiError))
+    except (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout, googlemaps.exceptions.ApiError) as err:
+      print("ERROR: Unable to geocode '{}' with Google: {}".format(addr, err))
+      return (0,0)
+
+    if len(geo_result) < 1:
+      print("ERROR: Unable to geocode '{}' with Google".format(addr))
+      return (0,0)
+    return (geo_result[0]['geometry']['location']['lat'], geo_result[0]['geometry']['location']['lng'])
+
+  def _google_request(self, addr):
+    self.limiter.wait()
+    return self.google_client.geocode(addr)
+
+  def _retry(self, request, errors):
+    """Call request, retrying on errors with exponential backoff; the last error is re-raised"""
+    for attempt in range(self.cfg.geocode_retries + 1):
+      try:
+        return request()
+      except errors:
+        if attempt == self.cfg.geocode_retries:
+          raise
+        time.sleep(self.cfg.geocode_backoff * (2 ** attempt))
+
+  def _format(self, address):
+    return "{} {}, {} {}".format(*address)
@@ -0,0 +1,115 @@
+from PIL import Image, ImageDraw, ImageFont
+
+import math
+import os
+
+TILE_SIZE = 256
+MAX_ZOOM = 18
+# zoom levels a map may back off from its stops to keep the depot in the picture
+DEPOT_ZOOM_OUT = 2
+
+class RouteMap:
+  """Draws a route straight from its coordinates: the depot, a line through the stops in delivery
+  order and a numbered marker on each stop.
+
+  The map frames the depot along with the stops, unless that would zoom out more than DEPOT_ZOOM_OUT
+  levels. A far-off depot is then drawn as an arrow at the edge of the image, on the line toward it.
+
+  When Config.tile_cache_dir holds map tiles laid out as {zoom}/{x}/{y}.png (the usual slippy map
+  scheme), the ones under the route are used as a basemap; nothing is ever fetched over the network.
+  """
+  def __init__(self, config):
+    self.cfg = config
+    self.width = self.cfg.map_width
+    self.height = self.cfg.map_height
+    self.padding = 40
+    self.font = ImageFont.load_default()
+
+  def render(self, origin, stops, filename):
+    """Save a PNG of the route from origin (lat, lon) through stops (a list of (lat, lon)) to filename"""
+    points = [tuple(origin)] + [tuple(s) for s in stops]
+    zoom = self._fit_zoom(points)
+    framed = points
+    if len(points) > 1 and self._fit_zoom(points[1:]) - zoom > DEPOT_ZOOM_OUT:
+      framed = points[1:]
+      zoom = self._fit_zoom(framed)
+    cx, cy = self._center(framed, zoom)
+    # top-left corner of the image in world pixels at this zoom
+    left = cx - self.width / 2.0
+    top = cy - self.height / 2.0
+
+    image = Image.new("RGB", (self.width, self.height), (242, 239, 233))
+    self._draw_tiles(image, zoom, left, top)
+    draw = ImageDraw.Draw(image)
+
+    xy = [(x - left, y - top) for (x, y) in (self._project(lat, lon, zoom) for (lat, lon) in points)]
+    depot = xy[0]
+    if framed is not points:
+      # the line from the first stop is cut where it leaves the image, and the depot shown there
+      xy[0] = self._clip(xy[1], depot, 24)
+    if len(xy) > 1:
+      draw.line(xy, fill=(33, 102, 172), width=4, joint="curve")
+
+    # depot
+    (x, y) = xy[0]
+    if xy[0] == depot:
+      draw.rectangle((x - 8, y - 8, x + 8, y + 8), fill=(0, 0, 0), outline=(255, 255, 255), width=2)
+    else:
+      angle = math.atan2(depot[1] - y, depot[0] - x)
+      tip = [(x + 18 * math.cos(angle + a), y + 18 * math.sin(angle + a)) for a in (0, 2.5, -2.5)]
+      draw.polygon(tip, fill=(0, 0, 0), outline=(255, 255, 255), width=2)
+
+    # stops, numbered in delivery order (drawn last to first so stop 1 ends up on top)
+    for number in range(len(xy) - 1, 0, -1):
+      (x, y) = xy[number]
+      draw.ellipse((x - 11, y - 11, x + 11, y + 11), fill=(215, 48, 39), outline=(255, 255, 255), width=2)
+      draw.text((x, y), str(number), fill=(255, 255, 255), font=self.font, anchor="mm")
+
+    # fast, light compression: these only ever go into a PDF
+    image.save(filename, compress_level=1)
+    return filename
+
+  # private methods
+
+  def _project(self, lat, lon, zoom):
+    """Web Mercator world pixel coordinates of lat/lon at zoom"""
+    scale = TILE_SIZE * (2 ** zoom)
+    siny = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    x = (lon + 180.0) / 360.0 * scale
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return (x, y)
+
+  def _fit_zoom(self, points):
+    # the closest (whole) zoom level at which every point fits inside the padded image
+    for zoom in range(MAX_ZOOM, -1, -1):
+      xs, ys = zip(*(self._project(lat, lon, zoom) for (lat, lon) in points))
+      if max(xs) - min(xs) <= self.width - 2 * self.padding and max(ys) - min(ys) <= self.height - 2 * self.padding:
+        return zoom
+    return 0
+
+  def _center(self, points, zoom):
+    xs, ys = zip(*(self._project(lat, lon, zoom) for (lat, lon) in points))
+    return ((max(xs) + min(xs)) / 2.0, (max(ys) + min(ys)) / 2.0)
+
+  def _clip(self, inside, outside, margin):
+    """The point where the segment from inside to outside (image pixels) leaves the image less margin"""
+    (x0, y0), (x1, y1) = inside, outside
+    t = 1.0
+    for (a, b, size) in ((x0, x1, self.width), (y0, y1, self.height)):
+      if b < margin:
+        t = min(t, (margin - a) / (b - a))
+      elif b > size - margin:
+        t = min(t, (size - margin - a) / (b - a))
+    t = max(t, 0.0)
+    return (x0 + t * (x1 - x0), y0 + t * (y1 - y0))
+
+  def _draw_tiles(self, image, zoom, left, top):
+    if not self.cfg.tile_cache_dir:
+      return
+
+    for tx in range(int(left // TILE_SIZE), int((left + self.width) // TILE_SIZE) + 1):
+      for ty in range(int(top // TILE_SIZE), int((top + self.height) // TILE_SIZE) + 1):
+        tile = os.path.join(self.cfg.tile_cache_dir, str(zoom), str(tx), "{}.png".format(ty))
+        if os.path.isfile(tile):
+          with Image.open(tile) as t:
+            image.paste(t.convert("RGB"), (int(tx * TILE_SIZE - left), int(ty * TILE_SIZE - top)))
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+
+import threading
+import resource
+import cProfile
+import atexit
+import pstats
+import json
+import time
+import sys
+
+class Metrics:
+  """Stage timings and counters for one run of one of the scripts.
+
+  Stages are timed with `with metrics.stage("geocode"):` (a stage entered more than once adds up),
+  counters bumped with metrics.count("geocode_calls", n). Only the main process is measured:
+  Pool workers keep their own (discarded) copy.
+  """
+  def __init__(self):
+    self.stages = {}
+    self.counters = {}
+    self.started = time.time()
+    self.lock = threading.Lock()
+
+  @contextmanager
+  def stage(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      with self.lock:
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+  def count(self, name, n=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + int(n)
+
+  def to_dict(self):
+    return {"started": self.started,
+            "seconds": round(time.time() - self.started, 4),
+            "stages": {name: round(t, 4) for name, t in self.stages.items()},
+            "counters": dict(self.counters),
+            "peak_memory_mb": peak_memory_mb(resource.RUSAGE_SELF),
+            "peak_worker_memory_mb": peak_memory_mb(resource.RUSAGE_CHILDREN)}
+
+  def save(self, path):
+    with open(path, "w") as f:
+      json.dump(self.to_dict(), f, indent=2)
+
+  def summary(self):
+    d = self.to_dict()
+    lines = ["{:<24} {:9.3f}s".format(name, t) for name, t in d["stages"].items()]
+    lines += ["{:<24} {:>10}".format(name, n) for name, n in d["counters"].items()]
+    lines.append("{:<24} {:8.1f}MB (workers {:.1f}MB)".format("peak memory", d["peak_memory_mb"], d["peak_worker_memory_mb"]))
+    return "\n".join(lines)
+
+# The metrics of the running script, shared by everything it calls
+METRICS = Metrics()
+
+def stage(name):
+  return METRICS.stage(name)
+
+def count(name, n=1):
+  METRICS.count(name, n)
+
+def add_arguments(parser):
+  """The --metrics/--profile flags every script takes"""
+  parser.add_argument('--metrics', type=str, help='write stage timings, counters and peak memory to this JSON file')
+  parser.add_argument('--profile', type=str, help='run under cProfile and write the stats to this file')
+
+def start(args, verbose=False):
+  """Begin measuring the script per its --metrics/--profile flags; the results are written when it exits
+  (including through sys.exit)"""
+  profiler = None
+  if args.profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+  atexit.register(_finish, args.metrics, args.profile, profiler, verbose)
+
+def peak_memory_mb(who):
+  # ru_maxrss is in kilobytes on Linux but bytes on macOS
+  rss = resource.getrusage(who).ru_maxrss
+  return round(rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+# private methods
+
+def _finish(metricsfile, profilefile, profiler, verbose):
+  if profiler:
+    profiler.disable()
+    profiler.dump_stats(profilefile)
+    if verbose:
+      pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+  if metricsfile:
+    METRICS.save(metricsfile)
+  if verbose and (metricsfile or profilefile):
+    print(METRICS.summary())
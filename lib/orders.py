@@ -0,0 +1,195 @@
+import json
+import math
+import numpy
+
+from lib import store
+
+def _column(name):
+  def get(self):
+    value = getattr(self.table, name)[self.i]
+    return value.item() if isinstance(value, numpy.generic) else value
+  def set(self, value):
+    getattr(self.table, name)[self.i] = value
+  return property(get, set)
+
+class Order:
+  """One row of an OrderTable: reads and writes go straight through to the table's columns.
+
+  Fields can be read as attributes (order.count) or like the dicts orders.json is made of
+  (order['count']), so code written against either keeps working.
+  """
+  __slots__ = ("table", "i")
+
+  id = _column("ids")
+  name = _column("names")
+  address = _column("addresses")
+  comments = _column("comments")
+  count = _column("count")
+  lat = _column("lat")
+  lon = _column("lon")
+  origin_dist = _column("origin_dist")
+  depot = _column("depots")
+
+  def __init__(self, table, i):
+    self.table = table
+    self.i = i
+
+  def __getitem__(self, key):
+    if key not in OrderTable.FIELDS:
+      raise KeyError(key)
+    return getattr(self, key)
+
+  def __contains__(self, key):
+    return key in OrderTable.FIELDS
+
+  def get(self, key, default=None):
+    return getattr(self, key) if key in OrderTable.FIELDS else default
+
+  def to_dict(self):
+    d = {}
+    for field in OrderTable.FIELDS:
+      value = getattr(self, field)
+      # orders that failed to geocode are NaN in the table but null in the JSON files
+      if isinstance(value, float) and math.isnan(value):
+        value = None
+      d[field] = value
+    return d
+
+  def __reduce__(self):
+    # pickle (e.g. to send to a Pool worker) as a plain dict rather than dragging the whole table along
+    return (dict, (self.to_dict(),))
+
+  def __repr__(self):
+    return "Order({})".format(self.to_dict())
+
+class OrderTable:
+  """Orders stored column-wise: numpy arrays for the numbers (parsed once, when the orders are loaded),
+  lists for the text, and an ID to row index map.
+
+  Behaves like the {id: order} dicts it replaces (len, in, [id], keys/values/items), handing out
+  Order views over its rows.
+  """
+  FIELDS = ("id", "name", "address", "count", "comments", "lat", "lon", "origin_dist", "depot")
+
+  def __init__(self, ids, names, addresses, comments, count, lat, lon, origin_dist, depots=None):
+    self.ids = list(ids)
+    self.names = list(names)
+    self.addresses = list(addresses)
+    self.comments = list(comments)
+    self.count = numpy.asarray(count, dtype=numpy.int32)
+    self.lat = numpy.asarray(lat, dtype=numpy.float64)
+    self.lon = numpy.asarray(lon, dtype=numpy.float64)
+    self.origin_dist = numpy.asarray(origin_dist, dtype=numpy.float64)
+    # name of the depot each order is delivered from (None with the single Config.origin)
+    self.depots = list(depots) if depots is not None else [None] * len(self.ids)
+    self.index = {id: i for i, id in enumerate(self.ids)}
+
+  @classmethod
+  def from_records(cls, records):
+    """Build a table from order dicts (as stored in orders.json/routes.json)"""
+    records = list(records)
+    return cls([r['id'] for r in records],
+               [r['name'] for r in records],
+               [r['address'] for r in records],
+               [r['comments'] for r in records],
+               [parse_count(r['id'], r['count']) for r in records],
+               [_float(r.get('lat')) for r in records],
+               [_float(r.get('lon')) for r in records],
+               [_float(r.get('origin_dist')) for r in records],
+               [r.get('depot') for r in records])
+
+  @classmethod
+  def from_routes(cls, routes):
+    """Build a table from the order dicts of a routes.json, returning it with the routes as lists of Order views"""
+    table = cls.from_records(d for route in routes for d in route)
+    views = []
+    i = 0
+    for route in routes:
+      views.append([Order(table, j) for j in range(i, i + len(route))])
+      i += len(route)
+    return (table, views)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, id):
+    return id in self.index
+
+  def __iter__(self):
+    return iter(self.ids)
+
+  def __getitem__(self, id):
+    return Order(self, self.index[id])
+
+  def keys(self):
+    return list(self.ids)
+
+  def values(self):
+    return [Order(self, i) for i in range(len(self.ids))]
+
+  def items(self):
+    return [(id, Order(self, i)) for i, id in enumerate(self.ids)]
+
+  def row(self, i):
+    return Order(self, i)
+
+  def rows(self, ids):
+    """Row indices of the given order IDs"""
+    return numpy.array([self.index[id] for id in ids], dtype=numpy.int64)
+
+  def subset(self, rows):
+    """A new table holding just the given rows"""
+    rows = [int(i) for i in rows]
+    return OrderTable([self.ids[i] for i in rows], [self.names[i] for i in rows], [self.addresses[i] for i in rows],
+                      [self.comments[i] for i in rows], self.count[rows], self.lat[rows], self.lon[rows],
+                      self.origin_dist[rows], [self.depots[i] for i in rows])
+
+  def to_dict(self):
+    return {id: Order(self, i).to_dict() for i, id in enumerate(self.ids)}
+
+  def add(self, record):
+    """Append an order dict as a new row, returning its Order view"""
+    if record['id'] in self.index:
+      raise ValueError("Order {} already exists".format(record['id']))
+    self.ids.append(record['id'])
+    self.names.append(record['name'])
+    self.addresses.append(record['address'])
+    self.comments.append(record.get('comments', ""))
+    self.count = numpy.append(self.count, numpy.int32(parse_count(record['id'], record['count'])))
+    self.lat = numpy.append(self.lat, _float(record.get('lat')))
+    self.lon = numpy.append(self.lon, _float(record.get('lon')))
+    self.origin_dist = numpy.append(self.origin_dist, _float(record.get('origin_dist')))
+    self.depots.append(record.get('depot'))
+    self.index[record['id']] = len(self.ids) - 1
+    return Order(self, len(self.ids) - 1)
+
+  def remove(self, id):
+    """Drop an order's row; the rows after it move up one, so Order views taken before are stale"""
+    i = self.index[id]
+    for column in (self.ids, self.names, self.addresses, self.comments, self.depots):
+      del column[i]
+    self.count = numpy.delete(self.count, i)
+    self.lat = numpy.delete(self.lat, i)
+    self.lon = numpy.delete(self.lon, i)
+    self.origin_dist = numpy.delete(self.origin_dist, i)
+    self.index = {id: i for i, id in enumerate(self.ids)}
+
+def parse_count(id, count):
+  """Bag counts come in as text from the CSV (and older JSON files), turn them into ints once"""
+  try:
+    return int(count)
+  except (TypeError, ValueError):
+    print("ERROR: Order {} has an invalid item count '{}'!".format(id, count))
+    return 0
+
+def load_routes(savefile):
+  """Load a routes.json (or routes.ndjson) file as a list of routes, each a list of Order views over one shared OrderTable"""
+  if store.is_ndjson(savefile):
+    routes = list(store.iter_ndjson(savefile))
+  else:
+    with open(savefile, 'r') as json_data:
+      routes = json.load(json_data)
+  return OrderTable.from_routes(routes)[1]
+
+def _float(value):
+  return float('nan') if value is None else float(value)
@@ -0,0 +1,152 @@
+import csv
+import sqlite3
+import time
+
+METERS_PER_MILE = 1609.344
+# miles stored for a pair the provider found no route between
+NO_ROUTE = -1.0
+
+class RoadDistanceCache:
+  """Road distances (miles) and durations (minutes) between coordinate pairs, kept in SQLite across runs and seasons"""
+  # SQLite's default limit on the number of ? parameters in one statement is 999
+  CHUNK = 500
+
+  def __init__(self, path):
+    self.path = path
+    self.db = sqlite3.connect(path)
+    self.db.execute("""CREATE TABLE IF NOT EXISTS road_distances (
+                         key TEXT PRIMARY KEY, miles REAL NOT NULL, minutes REAL, provider TEXT, created REAL NOT NULL)""")
+    self.db.commit()
+
+  @staticmethod
+  def key(a, b):
+    """Cache key for the drive from a to b, each a (lat, lon); ~1m of rounding so re-geocodes still match"""
+    return "{:.5f},{:.5f}|{:.5f},{:.5f}".format(a[0], a[1], b[0], b[1])
+
+  def get_many(self, keys):
+    """{key: miles} of the keys in the cache, None for pairs the provider found no route between"""
+    found = {}
+    keys = list(set(keys))
+    for start in range(0, len(keys), self.CHUNK):
+      chunk = keys[start:start + self.CHUNK]
+      rows = self.db.execute("SELECT key, miles FROM road_distances WHERE key IN ({})".format(",".join("?" * len(chunk))), chunk)
+      for (key, miles) in rows:
+        found[key] = miles if miles >= 0 else None
+    return found
+
+  def put_many(self, entries, provider):
+    """Store (key, miles, minutes) entries measured by provider (miles None when it found no route)"""
+    now = time.time()
+    self.db.executemany("INSERT OR REPLACE INTO road_distances (key, miles, minutes, provider, created) VALUES (?, ?, ?, ?, ?)",
+                        [(key, NO_ROUTE if miles is None else miles, minutes, provider, now) for (key, miles, minutes) in entries])
+    self.db.commit()
+
+  def close(self):
+    self.db.close()
+
+class DistanceProvider:
+  """Supplies road distances for pairs of orders; a pair it can't measure is left to the great-circle distance"""
+  name = None
+
+  def __init__(self, config):
+    self.cfg = config
+
+  def lookup(self, pairs):
+    """Given ((id, lat, lon), (id, lat, lon)) pairs, return the road miles for each (None when unknown)"""
+    raise NotImplementedError
+
+class GoogleDistanceProvider(DistanceProvider):
+  """Google Distance Matrix API, one origin against blocks of up to 25 destinations per request.
+
+  Every answer is kept in the RoadDistanceCache at Config.distance_cache so it's only ever paid for once;
+  Config.distance_base_url points the client at another server (e.g. a local stand-in) for testing.
+  """
+  name = "google"
+  # the API takes at most 25 destinations per request
+  BLOCK = 25
+
+  def __init__(self, config):
+    super().__init__(config)
+    if not self.cfg.google_api_key:
+      raise ValueError("Road distances from Google need Config.google_api_key")
+    import googlemaps
+    if self.cfg.distance_base_url:
+      self.client = googlemaps.Client(self.cfg.google_api_key, base_url=self.cfg.distance_base_url)
+    else:
+      self.client = googlemaps.Client(self.cfg.google_api_key)
+    self.cache = RoadDistanceCache(self.cfg.distance_cache)
+
+  def lookup(self, pairs):
+    keys = [RoadDistanceCache.key(a[1:], b[1:]) for (a, b) in pairs]
+    known = self.cache.get_many(keys)
+
+    # group what's missing by origin so each request is one origin and a block of its destinations
+    missing = {}
+    for key, (a, b) in zip(keys, pairs):
+      if key not in known:
+        missing.setdefault(tuple(a[1:]), {})[key] = tuple(b[1:])
+
+    requested = 0
+    for origin, destinations in missing.items():
+      items = list(destinations.items())
+      for start in range(0, len(items), self.BLOCK):
+        block = items[start:start + self.BLOCK]
+        entries = self._request(origin, block)
+        self.cache.put_many(entries, self.name)
+        for (key, miles, minutes) in entries:
+          known[key] = miles
+        requested += len(block)
+
+    if self.cfg.verbose:
+      print("Road distances: {} cached, {} requested from Google".format(len(set(keys)) - requested, requested))
+
+    return [known.get(key) for key in keys]
+
+  def _request(self, origin, block):
+    import googlemaps
+    try:
+      result = self.client.distance_matrix([origin], [b for (_, b) in block], mode="driving", units="imperial")
+    except (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout, googlemaps.exceptions.ApiError) as err:
+      print("ERROR: Unable to get road distances from {}: {}".format(origin, err))
+      return []
+
+    entries = []
+    for (key, _), element in zip(block, result['rows'][0]['elements']):
+      if element.get('status') == 'OK':
+        entries.append((key, element['distance']['value'] / METERS_PER_MILE, element['duration']['value'] / 60.0))
+      else:
+        # no route (NOT_FOUND, ZERO_RESULTS, ...) is remembered too, so it isn't paid for again next run
+        entries.append((key, None, None))
+    return entries
+
+class MatrixFileProvider(DistanceProvider):
+  """Road distances read from a precomputed CSV (Config.distance_matrix_file) with From, To, Miles columns"""
+  name = "file"
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.miles = {}
+    with open(self.cfg.distance_matrix_file, mode="r", encoding="utf-8-sig") as data_file:
+      for row in csv.DictReader(data_file):
+        self.miles[(row['From'], row['To'])] = float(row['Miles'])
+
+  def lookup(self, pairs):
+    return [self.miles.get((a[0], b[0])) for (a, b) in pairs]
+
+PROVIDERS = { p.name: p for p in (GoogleDistanceProvider, MatrixFileProvider) }
+
+def get_provider(name, config):
+  """Return the DistanceProvider called name, or None for plain great-circle ("haversine") distances"""
+  if name == "haversine":
+    return None
+  if name not in PROVIDERS:
+    raise ValueError("Unknown distance provider '{}' (choose from haversine, {})".format(name, ", ".join(sorted(PROVIDERS))))
+  return PROVIDERS[name](config)
+
+def missing_setting(config):
+  """What Config.distance_provider still needs to be set up (None when nothing), for the tools to report"""
+  if config.distance_provider == "google" and not config.google_api_key:
+    return "Road distances from Google need a google_api_key in the Config"
+  if config.distance_provider == "file" and not config.distance_matrix_file:
+    return "The file distance provider needs a road distance CSV (-m)"
+  return None
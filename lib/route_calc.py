@@ -1,143 +1,207 @@
-from geopy.distance import great_circle
 from collections import OrderedDict
-from operator import itemgetter
 
-import smartystreets_python_sdk
-import googlemaps
+from multiprocessing import Pool
+
+import numpy
+
+from lib import depots
+from lib import distance
+from lib import metrics
+from lib import sequencing
+from lib import store
+from lib.adjacency import Adjacencies
+from lib.orders import OrderTable, parse_count
+from lib.road_distance import get_provider
+from lib.solvers import get_solver
 
 import os.path
 import json
 
-class Container(object):
-  pass
-
 class ContainerEncoder(json.JSONEncoder):
   def default(self, obj):
+    # OrderTable and its Order rows know how to turn themselves into the plain dicts we save
+    if hasattr(obj, 'to_dict'):
+      return obj.to_dict()
     return obj.__dict__
 
 class RouteCalc:
   def __init__(self, config):
     self.cfg = config
-    if self.cfg.google_api_key:
-      self.google_client = googlemaps.Client(self.cfg.google_api_key)
-    else:
-      self.google_client = None
-    if self.cfg.smarty_auth_id:
-      credentials = smartystreets_python_sdk.StaticCredentials(self.cfg.smarty_auth_id, self.cfg.smarty_auth_token)
-      self.smarty_client = smartystreets_python_sdk.ClientBuilder(credentials).build_us_street_api_client()
-    else:
-      self.smarty_client = None
+    self._geocoder = None
     self.data = None
 
+  @property
+  def geocoder(self):
+    # built on first use, so tools that never geocode (regen.py) don't load the API clients or open the cache
+    if self._geocoder is None:
+      from lib.geocoder import Geocoder
+      self._geocoder = Geocoder(self.cfg)
+    return self._geocoder
+
   def load_csv(self, csv_data):
     self.data = self.validate_data(csv_data)
 
   def load_json(self, filename):
-    self.data = self.load_orders(filename)
+    with metrics.stage("orders_load"):
+      self.data = OrderTable.from_records(self.load_orders(filename).values())
+    # the depots may have changed since the orders were saved
+    self.assign_depots(self.data)
 
   def route(self):
     if self.data == None:
       print("ERROR: load_csv or load_json not called first!")
       return -1
 
-    # calculate the adjacencies (between each delivery address) if needed
-    adjacencies = self.load_adjacencies()
-    if len(adjacencies) != len(self.data):
-      adjacencies = self.calculate_adjacencies()
+    solver = get_solver(self.cfg.solver, self)
 
-    # Used to keep track of orders already in delivery plan
-    planned_deliveries = []
-    # Used to hold each of the delivery routes
-    delivery_routes = []
-
-    # Sort the orders by origin_dist, farthest to closest
-    orders = sorted(self.data.items(), key=lambda x: x[1].origin_dist)
-
-    # Now that each adjacency list is ordered, let's work through the deliveries
-    for k in reversed(orders):
-      k = k[0]
-      if k in planned_deliveries: continue
+    partitions = depots.partitions(self.cfg, self.data)
+    if len(partitions) > 1:
+      delivery_routes = self.solve_partitions(solver, partitions)
+    else:
+      delivery_routes = self.solve(solver)
+    metrics.count("routes", len(delivery_routes))
 
-      route = self.chunk_deliveries(k, adjacencies, planned_deliveries)
+    if self.cfg.consolidate:
+      from lib.consolidate import consolidate
+      delivery_routes = consolidate(self, delivery_routes)
 
-      delivery_routes.append(route)
-      planned_deliveries.extend(route)
+    if self.cfg.sequence:
+      delivery_routes = self.sequence_routes(delivery_routes)
 
     self.save_routes(self.expand_routes(delivery_routes))
     return 0
 
+  def solve(self, solver):
+    """Route all the orders as one problem"""
+    # calculate the adjacencies (between each delivery address) if needed
+    adjacencies = None
+    if solver.needs_adjacencies:
+      with metrics.stage("adjacency"):
+        adjacencies = self.load_adjacencies()
+        if adjacencies is None:
+          adjacencies = self.calculate_adjacencies()
+        adjacencies = self.apply_road_distances(adjacencies)
+
+    if self.cfg.verbose:
+      print("Routing {} orders with the {} solver".format(len(self.data), solver.name))
+    with metrics.stage("solve"):
+      delivery_routes = solver.solve(adjacencies)
+    return delivery_routes
+
+  def solve_partitions(self, solver, partitions):
+    """Route the orders of each depot (or each sector around one, see lib/depots.py) as a problem of
+    its own, in parallel, and merge the routes depot by depot"""
+    if self.cfg.verbose:
+      print("Routing {} orders in {} partitions with the {} solver".format(len(self.data), len(partitions), solver.name))
+
+    # hand out the biggest partitions first so the pool isn't left waiting on one of them at the end
+    order = sorted(range(len(partitions)), key=lambda p: -len(partitions[p][2]))
+    args = [(self.cfg, self.data.subset(partitions[p][2])) for p in order]
+    with metrics.stage("solve"):
+      with Pool(processes=self.cfg.processes) as pool:
+        results = dict(zip(order, pool.map(solve_partition, args, 1)))
+
+    delivery_routes = []
+    for p, (name, sector, rows) in enumerate(partitions):
+      if self.cfg.verbose:
+        print("{} (sector {}): {} orders on {} routes".format(name or "origin", sector + 1, len(rows), len(results[p])))
+      delivery_routes.extend(results[p])
+    return delivery_routes
+
+  def assign_depots(self, orders):
+    """Deliver each order from its nearest depot, measuring origin_dist from there"""
+    (orders.depots, orders.origin_dist) = depots.assign(self.cfg, orders.lat, orders.lon)
+
   # private methods
 
   def validate_data(self, data):
-    orders = {}
-    loaded_orders = self.load_orders("{}/orders.json".format(self.cfg.output_dir))
+    records = {}
+    loaded_orders = self.load_orders(self.output_file("orders"))
+    # orders (and their addresses) that still need to be geocoded, done all at once below
+    pending = {}
     rowNum = 1
     for address in data:
       rowNum += 1
       if len(address[self.cfg.map_key('NAME')]) > 0 and len(address[self.cfg.map_key('ADDRESS')].strip()) > 0:
-        entry = Container()
-        entry.id = address[self.cfg.map_key('ID')]
-        entry.name = address[self.cfg.map_key('NAME')]
-        entry.address = "{}, {}, {} {}".format(address[self.cfg.map_key('ADDRESS')].strip(), 
-                                               address[self.cfg.map_key('TOWN')].strip(), 
-                                               address[self.cfg.map_key('STATE')].strip(), 
-                                               address[self.cfg.map_key('ZIP')].strip().replace("'",""))
-        entry.count = address[self.cfg.map_key('BAGS')]
-        entry.comments = address[self.cfg.map_key('COMMENTS')]
-
-        if entry.count == 0:
-          print("ERROR: Order {} contains 0 items!".format(entry.id))
+        entry = {}
+        entry['id'] = address[self.cfg.map_key('ID')]
+        entry['name'] = address[self.cfg.map_key('NAME')]
+        entry['address'] = "{}, {}, {} {}".format(address[self.cfg.map_key('ADDRESS')].strip(), 
+                                                  address[self.cfg.map_key('TOWN')].strip(), 
+                                                  address[self.cfg.map_key('STATE')].strip(), 
+                                                  address[self.cfg.map_key('ZIP')].strip().replace("'",""))
+        entry['count'] = parse_count(entry['id'], address[self.cfg.map_key('BAGS')])
+        entry['comments'] = address[self.cfg.map_key('COMMENTS')]
+
+        if entry['count'] == 0:
+          print("ERROR: Order {} contains 0 items!".format(entry['id']))
     
         # avoid expensive calculations by reusing the data from the loaded orders
-        if entry.id in loaded_orders:
-          entry.lat = loaded_orders[entry.id]['lat']
-          entry.lon = loaded_orders[entry.id]['lon']
-          entry.origin_dist = loaded_orders[entry.id]['origin_dist']
+        if entry['id'] in loaded_orders:
+          entry['lat'] = loaded_orders[entry['id']]['lat']
+          entry['lon'] = loaded_orders[entry['id']]['lon']
+          entry['origin_dist'] = loaded_orders[entry['id']]['origin_dist']
         else:
-          (entry.lat, entry.lon) = self.geocode(address[self.cfg.map_key('ADDRESS')].strip(), 
-                                                address[self.cfg.map_key('TOWN')].strip(), 
-                                                address[self.cfg.map_key('STATE')].strip(), 
-                                                address[self.cfg.map_key('ZIP')].strip().replace("'",""))
-          entry.origin_dist = great_circle((self.cfg.origin[0], self.cfg.origin[1]), (entry.lat,entry.lon)).miles
+          pending[entry['id']] = (address[self.cfg.map_key('ADDRESS')].strip(), 
+                                  address[self.cfg.map_key('TOWN')].strip(), 
+                                  address[self.cfg.map_key('STATE')].strip(), 
+                                  address[self.cfg.map_key('ZIP')].strip().replace("'",""))
     
-        orders[entry.id] = entry
+        records[entry['id']] = entry
       else:
         print("ERROR: Bad entry in input '{}' in row {}".format(address[self.cfg.map_key('ID')], rowNum))
 
+    orders = OrderTable.from_records(records.values())
+
+    if pending:
+      rows = orders.rows(pending.keys())
+      with metrics.stage("geocode"):
+        coords = numpy.array(self.geocoder.geocode_many(list(pending.values())), dtype=numpy.float64)
+      orders.lat[rows] = coords[:, 0]
+      orders.lon[rows] = coords[:, 1]
+    self.assign_depots(orders)
+
     self.save_orders(orders)
 
     return orders
 
   def chunk_deliveries(self, id, adjacencies, planned_deliveries):
     route = [id]
-
-    # Start with the smallest truck capacity as we have more of those available
-    count = self.cfg.truck_capacity("Box Truck") - int(self.data[id].count)
-
-    if count < 0:
-      print("ERROR: Order {} is {} items, which won't fit on a Box Truck!".format(id, self.data[id].count))
-      # We upgrade to the next size of truck
-      count = self.cfg.truck_capacity("18' Flatbed") - int(self.data[id].count)
-
-    if count < 0:
-      print("ERROR: Order {} is {} items, which won't fit on an 18' Flatbed!".format(id, self.data[id].count))
-      # TODO: Try upgrading to the maximum size truck available -- For our troop we won't always get a 26' truck, 
-      # so the next option would be to split the order (which is done manually by editing routes.json before printing)
+    in_route = set(route)
+    # bag counts straight from the order table's column
+    counts = self.data.count
+    index = self.data.index
+
+    # Start with the first (smallest) truck in Config.trucks as we have more of those available, upgrading
+    # to the next size of truck while the order won't fit. Leave the bigger trucks out of Config.trucks
+    # when we won't get them.
+    bags = int(counts[index[id]])
+    for truck in self.cfg.trucks:
+      count = int(truck["capacity"]) - bags
+      if count >= 0: break
+      print("ERROR: Order {} is {} items, which won't fit on a {}!".format(id, bags, truck["type"]))
+
+    # TODO: When even the biggest truck is too small, the next option would be to split the order (which
+    # is done manually by editing routes.json before printing)
  
     # FIXME: This simple algorithm is flawed in that homes which are close via geocoords can be far via roads.
     # An example is two homes which are back-to-back with a stream between their backyards (sometimes there's no
     # water feature and the neighborhoods have no access between them).
-    for n in adjacencies[id]:
-      # PRECOND: adjacencies is sorted nearest to fathest, thus if the distance is 3 or more away, break
-      if n[1] > 3: break
+    neighbors, dists = adjacencies.row(adjacencies.index[id])
+    for n, d in zip(neighbors.tolist(), dists.tolist()):
+      # PRECOND: adjacencies is sorted nearest to fathest, thus if the distance is beyond the radius, break
+      if d > self.cfg.neighbor_radius: break
+      n = adjacencies.ids[n]
       # Skip this adjacency if it's already in another delivery route
-      if n[0] in planned_deliveries: continue
+      if n in planned_deliveries: continue
       # Skip this adjaceny if it's already in this delivery route
-      if n[0] in route: continue
+      if n in in_route: continue
       # If there's enough space left on the truck for this delivery, add it and lower the remaining space
-      if (count - int(self.data[n[0]].count)) >= 0:
-        route.append(n[0])
-        count = count - int(self.data[n[0]].count)
+      c = int(counts[index[n]])
+      if (count - c) >= 0:
+        route.append(n)
+        in_route.add(n)
+        count = count - c
 
     return route
 
@@ -152,54 +216,142 @@ class RouteCalc:
 
     return expanded_routes
 
+  def sequence_routes(self, routes):
+    """Reorder the stops of each route (lists of order IDs) into a short round trip from its depot"""
+    if self.cfg.verbose:
+      print("Sequencing the stops of {} routes".format(len(routes)))
+
+    with metrics.stage("sequence"):
+      matrices = [self.route_matrix(route) for route in routes]
+      args = [(D, self.cfg.sequence_time_budget) for D in matrices]
+      with Pool(processes=self.cfg.processes) as pool:
+        tours = pool.map(sequencing.sequence_tour, args, 1)
+
+    before = 0
+    after = 0
+    sequenced = []
+    for route, D, tour in zip(routes, matrices, tours):
+      before += sequencing.tour_length(D, range(len(D)))
+      after += sequencing.tour_length(D, tour)
+      # index 0 of the matrix is the origin, stops follow in route order
+      sequenced.append([route[i - 1] for i in tour[1:]])
+
+    if self.cfg.verbose:
+      print("Sequenced routes total {:.1f} miles (was {:.1f} miles)".format(after, before))
+
+    return sequenced
+
+  def route_matrix(self, route):
+    """Distances between the route's depot (index 0) and each stop of the route (index 1 onwards)"""
+    rows = self.data.rows(route)
+    origin = depots.location(self.cfg, self.data.depots[rows[0]])
+    lats = numpy.concatenate(([origin[0]], self.data.lat[rows]))
+    lons = numpy.concatenate(([origin[1]], self.data.lon[rows]))
+    return distance.distance_matrix(lats, lons)
+
   def calculate_adjacencies(self):
     if self.cfg.verbose:
       print("Calculating adjacencies")
-    adjacencies = {}
 
-    for k,v in self.data.items():
-      if not k in adjacencies:
-        adjacencies[k] = {}
-      for l,w in self.data.items():
-        if l == k: continue
-        adjacencies[k][l] = great_circle((v.lat, v.lon), (w.lat, w.lon)).miles
+    ids = self.data.ids
+    lats = self.data.lat
+    lons = self.data.lon
 
-    # Now that we've calculated all of the adjacencies, let's order them by distance
-    for a in adjacencies:
-      adjacencies[a] = sorted(adjacencies[a].items(), key=itemgetter(1))
+    # Only neighbors within the radius chunk_deliveries will look at are kept (at most max_neighbors
+    # of them, nearest first), found through a spatial index rather than by comparing every pair
+    adjacencies = Adjacencies.build(ids, lats, lons, self.cfg.neighbor_radius, self.cfg.max_neighbors)
 
     self.save_adjacencies(adjacencies)
 
     return adjacencies
 
+  def apply_road_distances(self, adjacencies):
+    """Swap in road distances (from Config.distance_provider) for each order's nearest neighbors"""
+    provider = get_provider(self.cfg.distance_provider, self.cfg)
+    if provider is None:
+      return adjacencies
+
+    # Only the road_neighbors nearest candidates of each order are looked up. The rest (and any pair
+    # the provider can't answer) are scaled by the typical road/great-circle ratio of the pairs that
+    # were, so that both kinds of distance sort and compare against the radius alike
+    slots = []
+    pairs = []
+    for i, id in enumerate(adjacencies.ids):
+      start = int(adjacencies.indptr[i])
+      neighbors, _ = adjacencies.row(i)
+      for offset, j in enumerate(neighbors[:self.cfg.road_neighbors].tolist()):
+        slots.append(start + offset)
+        pairs.append(((id, adjacencies.lats[i], adjacencies.lons[i]),
+                      (adjacencies.ids[j], adjacencies.lats[j], adjacencies.lons[j])))
+
+    dists = numpy.array(adjacencies.dists, dtype=numpy.float64)
+    measured = numpy.zeros(len(dists), dtype=bool)
+    metrics.count("road_distance_pairs", len(pairs))
+    for slot, miles in zip(slots, provider.lookup(pairs)):
+      if miles is not None:
+        dists[slot] = miles
+        measured[slot] = True
+
+    straight = numpy.asarray(adjacencies.dists, dtype=numpy.float64)
+    ratios = dists[measured & (straight > 0)] / straight[measured & (straight > 0)]
+    detour = max(float(numpy.median(ratios)), 1.0) if len(ratios) else 1.0
+    dists[~measured] *= detour
+
+    if self.cfg.verbose:
+      print("Using {} road distances from {} ({} pairs looked up, the rest {:.2f}x their great-circle distance)".format(
+            int(measured.sum()), provider.name, len(pairs), detour))
+
+    return adjacencies.with_distances(dists)
+
   def load_adjacencies(self):
-    adjacencies = {}
-    savefile = "{}/adjacencies.json".format(self.cfg.output_dir)
+    savefile = "{}/adjacencies".format(self.cfg.output_dir)
 
-    if os.path.isfile(savefile): 
-      with open(savefile, 'r') as json_data:
-        adjacencies = json.load(json_data)
+    ids = self.data.ids
+    lats = self.data.lat
+    lons = self.data.lon
+    key = Adjacencies.fingerprint(ids, lats, lons, self.cfg.neighbor_radius, self.cfg.max_neighbors)
+    adjacencies = Adjacencies.load(savefile)
+
+    if adjacencies is None or adjacencies.radius != self.cfg.neighbor_radius or adjacencies.k != self.cfg.max_neighbors:
+      if self.cfg.verbose:
+        print("No matching adjacencies in {}".format(savefile))
+      return None
 
     if self.cfg.verbose:
       print("Loaded {} adjacencies from {}".format(len(adjacencies), savefile))
 
+    # When orders were added, cancelled or re-geocoded since the cache was saved, patch up just
+    # the affected neighbor lists rather than recomputing all of them
+    if adjacencies.key() != key:
+      (added, removed, moved) = adjacencies.diff(ids, lats, lons)
+      adjacencies = adjacencies.update(ids, lats, lons)
+      if self.cfg.verbose:
+        print("Updated adjacencies for {} added, {} removed and {} moved orders".format(len(added), len(removed), len(moved)))
+      self.save_adjacencies(adjacencies)
+
     return adjacencies
 
   def save_adjacencies(self, data):
-    savefile = "{}/adjacencies.json".format(self.cfg.output_dir)
+    savefile = "{}/adjacencies".format(self.cfg.output_dir)
 
-    with open(savefile, 'w') as f:
-      json.dump(data, f, indent=2, cls=ContainerEncoder)
+    data.save(savefile)
 
     if self.cfg.verbose:
       print("Saved {} adjacencies to {}".format(len(data), savefile))
 
+  def output_file(self, name):
+    """Path of the orders/routes file in the output directory, in the configured file format"""
+    return "{}/{}.{}".format(self.cfg.output_dir, name, self.cfg.file_format)
+
   def load_orders(self, savefile):
     orders = {}
 
     if os.path.isfile(savefile): 
-      with open(savefile, 'r') as json_data:
-        orders = json.load(json_data)
+      if store.is_ndjson(savefile):
+        orders = {o['id']: o for o in store.iter_ndjson(savefile)}
+      else:
+        with open(savefile, 'r') as json_data:
+          orders = json.load(json_data)
 
     if self.cfg.verbose:
       print("Loaded {} orders from {}".format(len(orders), savefile))
@@ -207,22 +359,30 @@ class RouteCalc:
     return orders
 
   def save_orders(self, data):
-    savefile = "{}/orders.json".format(self.cfg.output_dir)
+    savefile = self.output_file("orders")
 
     if not os.path.exists(self.cfg.output_dir):
       os.makedirs(self.cfg.output_dir)
 
-    with open(savefile, 'w') as f:
-      json.dump(data, f, indent=2, cls=ContainerEncoder)
+    with metrics.stage("save"):
+      if store.is_ndjson(savefile):
+        store.write_ndjson(savefile, data.values(), ContainerEncoder)
+      else:
+        with open(savefile, 'w') as f:
+          json.dump(data, f, indent=2, cls=ContainerEncoder)
 
     if self.cfg.verbose:
       print("Saved {} orders to {}".format(len(data), savefile))
 
   def save_routes(self, routes):
-    savefile = "{}/routes.json".format(self.cfg.output_dir)
+    savefile = self.output_file("routes")
 
-    with open(savefile, 'w') as f:
-      json.dump(routes, f, indent=2, cls=ContainerEncoder)
+    with metrics.stage("save"):
+      if store.is_ndjson(savefile):
+        store.write_ndjson(savefile, routes, ContainerEncoder)
+      else:
+        with open(savefile, 'w') as f:
+          json.dump(routes, f, indent=2, cls=ContainerEncoder)
 
     if self.cfg.verbose:
       print("Saved {} routes with {} orders to {}".format(len(routes), self.count_orders_in_routes(routes), savefile))
@@ -235,35 +395,17 @@ class RouteCalc:
     return orders
 
   def geocode(self, street, city, state, zipc):
-    addr = "{} {}, {} {}".format(street, city, state, zipc)
-
-    if self.smarty_client:
-      if self.cfg.verbose:
-        print("Geocoding '{}' with SmartyStreets".format(addr))
-      
-      lookup = smartystreets_python_sdk.us_street.Lookup()
-      lookup.street = street
-      lookup.city = city
-      lookup.state = state
-      #lookup.zip = zipc
-      try:
-        self.smarty_client.send_lookup(lookup)
-      except smartystreets_python_sdk.exceptions.SmartyException as err:
-        print(err)
-        return (0,0)
-
-      if not lookup.result:
-        print("ERROR: Cannot geocode {}: invalid!".format(addr))
-        return (None,None)
-
-      return (lookup.result[0].metadata.latitude, lookup.result[0].metadata.longitude)
-    elif self.google_client:
-      if self.cfg.verbose:
-        print("Geocoding '{}' with Google".format(addr))
-
-      geo_result = self.google_client.geocode(addr)
-      if len(geo_result) < 1:
-        print("ERROR: Unable to geocode '{}' with Google".format(addr))
-      else:
-        return (geo_result[0]['geometry']['location']['lat'], geo_result[0]['geometry']['location']['lng'])
-    return (0,0)
+    return self.geocoder.geocode(street, city, state, zipc)
+
+def solve_partition(arg):
+  """Pool wrapper: route one partition (an OrderTable of its orders) from its depot"""
+  (config, orders) = arg
+  calc = RouteCalc(config)
+  calc.data = orders
+  solver = get_solver(config.solver, calc)
+  adjacencies = None
+  if solver.needs_adjacencies:
+    # kept in memory, the adjacencies file in the output directory belongs to the whole order set
+    adjacencies = Adjacencies.build(orders.ids, orders.lat, orders.lon, config.neighbor_radius, config.max_neighbors)
+    adjacencies = calc.apply_road_distances(adjacencies)
+  return solver.solve(adjacencies)
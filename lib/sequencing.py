@@ -0,0 +1,94 @@
+import numpy
+import time
+
+# Improvements smaller than this (in miles) are treated as noise so the search always terminates
+EPSILON = 1e-9
+
+def improve_tour(D, time_budget=None):
+  """Reorder a round trip over the points of distance matrix D, starting and ending at point 0 (the depot).
+
+  Alternates 2-opt (reverse a stretch of the tour) and Or-opt (move a run of 1-3 stops elsewhere,
+  possibly reversed) passes until neither finds an improvement or time_budget seconds have gone by.
+  Each move is scored against all of its possible partners at once with numpy.
+  Returns the visiting order as indices into D, beginning with 0.
+  """
+  D = numpy.asarray(D, dtype=numpy.float64)
+  m = len(D)
+  tour = numpy.arange(m)
+  if m < 4:
+    return tour
+
+  deadline = time.time() + time_budget if time_budget else None
+  improved = True
+  while improved:
+    improved = _two_opt_pass(D, tour, deadline)
+    improved = _or_opt_pass(D, tour, deadline) or improved
+    if deadline and time.time() > deadline:
+      break
+
+  return tour
+
+def tour_length(D, tour):
+  tour = numpy.asarray(tour)
+  return float(numpy.asarray(D)[tour, numpy.roll(tour, -1)].sum())
+
+def sequence_tour(arg):
+  """Pool-friendly wrapper around improve_tour, takes (D, time_budget)"""
+  D = arg[0]
+  time_budget = arg[1]
+  return improve_tour(D, time_budget)
+
+# private methods
+def _two_opt_pass(D, tour, deadline):
+  m = len(tour)
+  improved = False
+
+  for i in range(1, m - 1):
+    a, b = tour[i - 1], tour[i]
+    js = numpy.arange(i + 1, m)
+    c, d = tour[js], tour[(js + 1) % m]
+    delta = D[a, c] + D[b, d] - D[a, b] - D[c, d]
+    best = int(numpy.argmin(delta))
+    if delta[best] < -EPSILON:
+      j = js[best]
+      tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+      improved = True
+    if deadline and time.time() > deadline:
+      break
+
+  return improved
+
+def _or_opt_pass(D, tour, deadline):
+  m = len(tour)
+  improved = False
+
+  for length in (1, 2, 3):
+    i = 1
+    while i + length <= m:
+      seg = tour[i:i + length].copy()
+      prev, nxt = tour[i - 1], tour[(i + length) % m]
+      gain = D[prev, seg[0]] + D[seg[-1], nxt] - D[prev, nxt]
+
+      # the tour without the segment keeps the depot up front, try the segment in every gap of it
+      rest = numpy.concatenate((tour[:i], tour[i + length:]))
+      p, q = rest, numpy.roll(rest, -1)
+      forward = D[p, seg[0]] + D[seg[-1], q] - D[p, q]
+      backward = D[p, seg[-1]] + D[seg[0], q] - D[p, q]
+      # putting it back where it came from is not a move
+      forward[i - 1] = numpy.inf
+      backward[i - 1] = numpy.inf
+
+      k = int(numpy.argmin(numpy.minimum(forward, backward)))
+      cost = min(forward[k], backward[k])
+      if cost - gain < -EPSILON:
+        if backward[k] < forward[k]:
+          seg = seg[::-1]
+        tour[:] = numpy.concatenate((rest[:k + 1], seg, rest[k + 1:]))
+        improved = True
+      else:
+        i += 1
+
+      if deadline and time.time() > deadline:
+        return improved
+
+  return improved
@@ -0,0 +1,354 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import threading
+import traceback
+import signal
+import json
+import time
+import csv
+import re
+import os
+
+from lib import depots
+from lib.consolidate import consolidate
+from lib.adjacency import Adjacencies
+from lib.export import RouteSummary, WRITERS, export_routes
+from lib.orders import parse_count
+from lib.route_calc import RouteCalc, ContainerEncoder
+from lib.solvers import get_solver
+from lib.store import open_routes
+
+# order fields that can be changed in place, the address ones mean geocoding the order again
+EDITABLE = ("name", "count", "comments")
+ADDRESS = ("street", "city", "state", "zip")
+
+class RoutingService:
+  """A RouteCalc kept loaded between requests: orders, routes (lists of order IDs), the neighbor lists
+  and the geocode cache all stay in memory while orders are added, cancelled, changed and moved.
+
+  Changes are written back to orders.json/routes.json in Config.output_dir every
+  Config.service_snapshot_interval seconds (and on shutdown), so the other tools can work on them.
+  Every operation holds the service's lock, so requests are handled one at a time.
+  """
+  def __init__(self, calc, routes):
+    self.calc = calc
+    self.cfg = calc.cfg
+    self.routes = routes
+    self.adjacencies = None
+    # whether the neighbor lists were patched since they were last saved
+    self.adjacencies_changed = False
+    self.changed = False
+    self.lock = threading.RLock()
+
+  @classmethod
+  def load(cls, config, csvfile=None):
+    """Start from the orders CSV (geocoding what isn't cached) or the orders/routes files in the output directory"""
+    calc = RouteCalc(config)
+    if csvfile:
+      with open(csvfile, mode="r", encoding="utf-8-sig") as data_file:
+        calc.load_csv(list(csv.DictReader(data_file)))
+    else:
+      calc.load_json(calc.output_file("orders"))
+
+    routes = []
+    routesfile = calc.output_file("routes")
+    if os.path.isfile(routesfile):
+      for route in open_routes(routesfile):
+        route = [d['id'] for d in route if d['id'] in calc.data]
+        if route:
+          routes.append(route)
+      if config.verbose:
+        print("Loaded {} routes from {}".format(len(routes), routesfile))
+    return cls(calc, routes)
+
+  # queries
+
+  def orders(self):
+    with self.lock:
+      return [order.to_dict() for order in self.calc.data.values()]
+
+  def order(self, id):
+    with self.lock:
+      return self.calc.data[id].to_dict()
+
+  def route_summaries(self):
+    with self.lock:
+      routed = set(id for route in self.routes for id in route)
+      summaries = []
+      for idx, route in enumerate(self.calc.expand_routes(self.routes)):
+        s = RouteSummary(self.cfg, idx+1, route)
+        summaries.append({"route": s.name, "bags": s.bags, "stops": s.stops, "truck": s.truck, "depot": s.depot, "ids": s.ids})
+      return {"routes": summaries, "unrouted": [id for id in self.calc.data if id not in routed]}
+
+  # operations
+
+  def add_order(self, fields):
+    """Add an order (id, name, count, comments and either street/city/state/zip or address/lat/lon),
+    optionally straight onto a route"""
+    with self.lock:
+      for field in ("id", "name", "count"):
+        if field not in fields:
+          raise ValueError("An order needs an {}".format(field))
+      if fields["id"] in self.calc.data:
+        raise ValueError("Order {} already exists".format(fields["id"]))
+      # everything is checked before the order goes in, so a bad request leaves nothing behind
+      count = parse_count(fields["id"], fields["count"])
+      place = self._check_place(fields["route"], fields.get("position")) if fields.get("route") else None
+      record = {"id": fields["id"], "name": fields["name"], "count": count, "comments": fields.get("comments", "")}
+      record.update(self._locate(fields))
+      order = self.calc.data.add(record)
+      if place:
+        self._place(order.id, *place)
+      self.changed = True
+      return order.to_dict()
+
+  def cancel_order(self, id):
+    with self.lock:
+      order = self.calc.data[id].to_dict()
+      self._unplace(id)
+      self.routes = [route for route in self.routes if route]
+      self.calc.data.remove(id)
+      self.changed = True
+      return order
+
+  def modify_order(self, id, fields):
+    """Change an order's name, bag count or comments; a new street/city/state/zip (or lat/lon) moves it"""
+    with self.lock:
+      order = self.calc.data[id]
+      for field in fields:
+        if field not in EDITABLE + ADDRESS + ("address", "lat", "lon"):
+          raise ValueError("Order field {} can't be changed".format(field))
+      if "address" in fields and not ("lat" in fields and "lon" in fields):
+        raise ValueError("An address can only be given along with lat and lon (or send street/city/state/zip)")
+
+      # everything is checked (and geocoded) before anything is written, so a bad request changes nothing
+      count = parse_count(id, fields["count"]) if "count" in fields else None
+      location = self._locate(fields) if any(field in fields for field in ADDRESS + ("lat", "lon")) else None
+      if "name" in fields:
+        order.name = fields["name"]
+      if "comments" in fields:
+        order.comments = fields["comments"]
+      if count is not None:
+        order.count = count
+      if location:
+        order.address = location["address"] if location["address"] else order.address
+        order.lat = location["lat"]
+        order.lon = location["lon"]
+        order.origin_dist = location["origin_dist"]
+        order.depot = location["depot"]
+      self.changed = True
+      return order.to_dict()
+
+  def move_order(self, id, route, position=None):
+    """Move an order to route number route (1-based; one past the last starts a new route), at position
+    (0-based, the end by default)"""
+    with self.lock:
+      if id not in self.calc.data:
+        raise KeyError(id)
+      (route, position) = self._check_place(route, position)
+      self._unplace(id)
+      self._place(id, route, position)
+      self.routes = [r for r in self.routes if r]
+      self.changed = True
+      return self.route_summaries()
+
+  def solve(self, solver=None, sequence=None):
+    """Route every order again (with the configured solver unless one is given)"""
+    with self.lock:
+      solver = get_solver(solver or self.cfg.solver, self.calc)
+      partitions = depots.partitions(self.cfg, self.calc.data)
+      if len(partitions) > 1:
+        routes = self.calc.solve_partitions(solver, partitions)
+      else:
+        adjacencies = None
+        if solver.needs_adjacencies:
+          adjacencies = self.calc.apply_road_distances(self.current_adjacencies())
+        routes = solver.solve(adjacencies)
+      if self.cfg.consolidate:
+        routes = consolidate(self.calc, routes)
+      if sequence is None:
+        sequence = self.cfg.sequence
+      if sequence:
+        routes = self.calc.sequence_routes(routes)
+      self.routes = routes
+      self.changed = True
+      return self.route_summaries()
+
+  def export(self, outputs):
+    with self.lock:
+      unknown = [o for o in outputs if o not in WRITERS]
+      if unknown:
+        raise ValueError("Unknown output {} (choose from {})".format(", ".join(unknown), ", ".join(WRITERS)))
+      summaries = export_routes(self.cfg, self.calc.expand_routes(self.routes), outputs)
+      return {"routes": len(summaries), "outputs": ["{}/{}".format(self.cfg.output_dir, WRITERS[o].filename) for o in outputs]}
+
+  def snapshot(self):
+    """Write orders, routes and the neighbor lists to the output directory for the other tools"""
+    with self.lock:
+      self.calc.save_orders(self.calc.data)
+      self.calc.save_routes(self.calc.expand_routes(self.routes))
+      if self.adjacencies_changed:
+        self.calc.save_adjacencies(self.adjacencies)
+        self.adjacencies_changed = False
+      self.changed = False
+      return {"orders": len(self.calc.data), "routes": len(self.routes)}
+
+  def current_adjacencies(self):
+    """The neighbor lists for the orders as they are now, patched up incrementally as orders change"""
+    data = self.calc.data
+    if self.adjacencies is None:
+      self.adjacencies = self.calc.load_adjacencies()
+      if self.adjacencies is None:
+        self.adjacencies = self.calc.calculate_adjacencies()
+    elif self.adjacencies.key() != Adjacencies.fingerprint(data.ids, data.lat, data.lon, self.cfg.neighbor_radius, self.cfg.max_neighbors):
+      self.adjacencies = self.adjacencies.update(data.ids, data.lat, data.lon)
+      self.adjacencies_changed = True
+    return self.adjacencies
+
+  def autosave(self):
+    """Snapshot every Config.service_snapshot_interval seconds while there are unsaved changes (runs forever)"""
+    while True:
+      time.sleep(self.cfg.service_snapshot_interval)
+      with self.lock:
+        if self.changed:
+          self.snapshot()
+
+  # private methods
+
+  def _locate(self, fields):
+    """address, lat, lon, depot and origin_dist for the location in fields (geocoded through the cache when not given)"""
+    if fields.get("lat") is not None and fields.get("lon") is not None:
+      lat, lon = float(fields["lat"]), float(fields["lon"])
+      address = fields.get("address")
+    else:
+      street, city, state, zipc = (str(fields.get(field, "")).strip() for field in ADDRESS)
+      if not street:
+        raise ValueError("An order needs a street (or lat and lon)")
+      (lat, lon) = self.calc.geocoder.geocode_many([(street, city, state, zipc)])[0]
+      if not lat or not lon:
+        raise ValueError("Cannot geocode {}, {}, {} {}".format(street, city, state, zipc))
+      address = "{}, {}, {} {}".format(street, city, state, zipc)
+    (names, dists) = depots.assign(self.cfg, [lat], [lon])
+    return {"address": address, "lat": lat, "lon": lon, "origin_dist": float(dists[0]), "depot": names[0]}
+
+  def _unplace(self, id):
+    for route in self.routes:
+      if id in route:
+        route.remove(id)
+
+  def _check_place(self, route, position=None):
+    """(route, position) as numbers, raising ValueError when they don't name a place on the routes"""
+    if route is None:
+      raise ValueError("A route number is needed")
+    route = int(route)
+    if route < 1 or route > len(self.routes) + 1:
+      raise ValueError("There is no route-{} (there are {})".format(route, len(self.routes)))
+    if position is not None:
+      position = int(position)
+      if position < 0:
+        raise ValueError("Position {} is before the first stop".format(position))
+    return (route, position)
+
+  def _place(self, id, route, position=None):
+    (route, position) = self._check_place(route, position)
+    if route == len(self.routes) + 1:
+      self.routes.append([])
+    stops = self.routes[route - 1]
+    stops.insert(len(stops) if position is None else position, id)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+  """JSON over HTTP for a RoutingService (the server's service attribute):
+
+    GET    /orders, /orders/<id>, /routes
+    POST   /orders                  add an order
+    PATCH  /orders/<id>             change an order
+    DELETE /orders/<id>             cancel an order
+    POST   /orders/<id>/move        {"route": n, "position": p}
+    POST   /solve                   {"solver": "savings", "sequence": true} (both optional)
+    POST   /export                  {"outputs": ["orders", "routes", ...]}
+    POST   /snapshot
+
+  Order IDs go in the path URL-encoded (#1001 is %231001).
+  """
+  ROUTES = [
+    ("GET", r"/orders", lambda s, m, body: s.orders()),
+    ("GET", r"/orders/([^/]+)", lambda s, m, body: s.order(m[0])),
+    ("GET", r"/routes", lambda s, m, body: s.route_summaries()),
+    ("POST", r"/orders", lambda s, m, body: s.add_order(body)),
+    ("PATCH", r"/orders/([^/]+)", lambda s, m, body: s.modify_order(m[0], body)),
+    ("DELETE", r"/orders/([^/]+)", lambda s, m, body: s.cancel_order(m[0])),
+    ("POST", r"/orders/([^/]+)/move", lambda s, m, body: s.move_order(m[0], body.get("route"), body.get("position"))),
+    ("POST", r"/solve", lambda s, m, body: s.solve(body.get("solver"), body.get("sequence"))),
+    ("POST", r"/export", lambda s, m, body: s.export(body.get("outputs", list(WRITERS)))),
+    ("POST", r"/snapshot", lambda s, m, body: s.snapshot()),
+  ]
+
+  def do_GET(self):
+    self._dispatch("GET")
+
+  def do_POST(self):
+    self._dispatch("POST")
+
+  def do_PATCH(self):
+    self._dispatch("PATCH")
+
+  def do_DELETE(self):
+    self._dispatch("DELETE")
+
+  def log_message(self, format, *args):
+    if self.server.service.cfg.verbose:
+      super().log_message(format, *args)
+
+  def _dispatch(self, method):
+    path = self.path.split("?", 1)[0].rstrip("/")
+    for (verb, pattern, handler) in self.ROUTES:
+      match = re.fullmatch(pattern, path)
+      if verb == method and match:
+        break
+    else:
+      return self._reply(404, {"error": "No such endpoint {} {}".format(method, path)})
+
+    try:
+      length = int(self.headers.get("Content-Length") or 0)
+      body = json.loads(self.rfile.read(length)) if length else {}
+      result = handler(self.server.service, [unquote(g) for g in match.groups()], body)
+    except KeyError as err:
+      return self._reply(404, {"error": "Unknown order {}".format(err.args[0])})
+    except (ValueError, TypeError) as err:
+      return self._reply(400, {"error": str(err)})
+    except Exception as err:
+      # anything else is a bug, still answer so the client isn't left with a dropped connection
+      traceback.print_exc()
+      return self._reply(500, {"error": "{}: {}".format(type(err).__name__, err)})
+    self._reply(200, result)
+
+  def _reply(self, status, result):
+    data = json.dumps(result, cls=ContainerEncoder).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+def serve(service, host, port):
+  """Answer requests until interrupted, then write a last snapshot"""
+  server = ThreadingHTTPServer((host, port), ServiceHandler)
+  server.service = service
+  threading.Thread(target=service.autosave, daemon=True).start()
+  if service.cfg.verbose:
+    print("Serving {} orders on {} routes at http://{}:{}/".format(len(service.calc.data), len(service.routes), host, port))
+  # stopping with SIGTERM (e.g. from a service manager) still writes the last snapshot
+  signal.signal(signal.SIGTERM, _interrupt)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    service.snapshot()
+
+# private methods
+
+def _interrupt(signum, frame):
+  raise KeyboardInterrupt()
@@ -0,0 +1,218 @@
+import heapq
+import numpy
+
+from lib import depots
+from lib import distance
+
+# routes either side of an order's own (in sweep order) that the sweep solver's k-means may move it to
+SWEEP_WINDOW = 2
+
+class Solver:
+  """Turns the orders loaded into a RouteCalc into delivery routes (lists of order IDs)"""
+  name = None
+  # whether solve() needs the per-order neighbor lists (see lib/adjacency.py)
+  needs_adjacencies = True
+
+  def __init__(self, calc):
+    self.calc = calc
+    self.cfg = calc.cfg
+
+  def solve(self, adjacencies):
+    raise NotImplementedError
+
+class GreedySolver(Solver):
+  """Start a route at the farthest unplanned order and fill it up from its nearest neighbors"""
+  name = "greedy"
+
+  def solve(self, adjacencies):
+    data = self.calc.data
+    # Used to keep track of orders already in delivery plan
+    planned_deliveries = set()
+    # Used to hold each of the delivery routes
+    delivery_routes = []
+
+    # Sort the orders by origin_dist, farthest to closest
+    origin_dist = data.origin_dist
+    if self.cfg.seed is not None:
+      # a seeded run starts its routes in a shuffled order among orders within a mile of each other
+      origin_dist = origin_dist + numpy.random.default_rng(self.cfg.seed).random(len(origin_dist))
+    orders = numpy.argsort(origin_dist, kind="stable")
+
+    # Now that each adjacency list is ordered, let's work through the deliveries
+    for i in reversed(orders.tolist()):
+      k = data.ids[i]
+      if k in planned_deliveries: continue
+
+      route = self.calc.chunk_deliveries(k, adjacencies, planned_deliveries)
+
+      delivery_routes.append(route)
+      planned_deliveries.update(route)
+
+    return delivery_routes
+
+class SavingsSolver(Solver):
+  """Clarke-Wright savings: start with one route per order and keep joining the two routes whose
+  ends save the most miles over driving each from the depot, as long as the truck can hold both.
+
+  Only pairs in the neighbor lists are considered, so the work grows with n * k rather than n * n.
+  Routes are sized for the first (smallest and most plentiful) truck in Config.trucks.
+  """
+  name = "savings"
+
+  def solve(self, adjacencies):
+    data = self.calc.data
+    ids = adjacencies.ids
+    n = len(ids)
+    capacity = self.cfg.trucks[0]["capacity"]
+    rows = data.rows(ids)
+    counts = data.count[rows].astype(numpy.int64)
+    depot = data.origin_dist[rows]
+
+    # Every candidate pair once (lists are capped at k so a pair may only show up in one direction)
+    src = numpy.repeat(numpy.arange(n, dtype=numpy.int64), numpy.diff(adjacencies.indptr))
+    dst = numpy.asarray(adjacencies.neighbors, dtype=numpy.int64)
+    dist = numpy.asarray(adjacencies.dists, dtype=numpy.float64)
+    a, b = numpy.minimum(src, dst), numpy.maximum(src, dst)
+    _, first = numpy.unique(a * n + b, return_index=True)
+    a, b, dist = a[first], b[first], dist[first]
+    savings = depot[a] + depot[b] - dist
+
+    # the neighbor lists may reach further than neighbor_radius (e.g. when shared across a sweep)
+    keep = (savings > 0) & (dist <= self.cfg.neighbor_radius)
+    heap = list(zip((-savings[keep]).tolist(), a[keep].tolist(), b[keep].tolist()))
+    heapq.heapify(heap)
+
+    # union-find over orders, each root holding its route (in stop order) and load
+    parent = list(range(n))
+    routes = {i: [i] for i in range(n)}
+    loads = {i: int(counts[i]) for i in range(n)}
+
+    def find(i):
+      while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+      return i
+
+    while heap:
+      _, i, j = heapq.heappop(heap)
+      ri, rj = find(i), find(j)
+      if ri == rj or loads[ri] + loads[rj] > capacity:
+        continue
+      route_i, route_j = routes[ri], routes[rj]
+      # only the ends of two routes can be joined, i at the tail of one and j at the head of the other
+      if route_i[-1] != i:
+        if route_i[0] != i: continue
+        route_i.reverse()
+      if route_j[0] != j:
+        if route_j[-1] != j: continue
+        route_j.reverse()
+
+      route_i.extend(route_j)
+      parent[rj] = ri
+      loads[ri] += loads.pop(rj)
+      del routes[rj]
+
+    # Farthest routes first, like the greedy solver
+    merged = sorted(routes.values(), key=lambda r: -depot[r].max())
+    return [[ids[i] for i in r] for r in merged]
+
+class SweepSolver(Solver):
+  """The classic sweep: line the orders up by polar angle around their depot (nearest first at the
+  same angle) and cut that line into a new route whenever the next order won't fit on the truck.
+
+  Needs no neighbor lists, only a sort, so it's the quick option for what-ifs and very large order
+  books. Config.sweep_kmeans rounds of k-means then move orders to a nearby route whose center is nearer
+  them, when it has room. Routes are sized for the first truck in Config.trucks, like savings.
+  """
+  name = "sweep"
+  needs_adjacencies = False
+
+  def solve(self, adjacencies):
+    data = self.calc.data
+    capacity = self.cfg.trucks[0]["capacity"]
+    counts = data.count.astype(numpy.int64)
+    located = ~numpy.isnan(data.lat) & ~numpy.isnan(data.lon)
+
+    # route number and place in the sweep of each row, cut in sweep order depot by depot
+    route_of = numpy.full(len(data), -1, dtype=numpy.int64)
+    position = numpy.zeros(len(data), dtype=numpy.int64)
+    # the depot (index into depot_list) each route is loaded at
+    route_depot = []
+    for d, (name, lat, lon) in enumerate(depots.depot_list(self.cfg)):
+      rows = numpy.flatnonzero(located & numpy.array([d == name for d in data.depots], dtype=bool))
+      if not len(rows):
+        continue
+      order = rows[depots.polar_order(lat, lon, data.lat[rows], data.lon[rows], data.origin_dist[rows])]
+      position[order] = numpy.arange(len(order))
+      load = capacity
+      for i, c in zip(order.tolist(), counts[order].tolist()):
+        # an order bigger than the truck gets a route (and a bigger truck) of its own
+        if load + c > capacity:
+          route_depot.append(d)
+          load = 0
+        route_of[i] = len(route_depot) - 1
+        load += c
+
+    route_depot = numpy.array(route_depot, dtype=numpy.int64)
+    for _ in range(self.cfg.sweep_kmeans):
+      if not self._refine(route_of, route_depot, located, capacity):
+        break
+
+    # orders that failed to geocode go on routes of their own, to be placed by hand
+    unlocated = numpy.flatnonzero(route_of < 0)
+    route_of[unlocated] = len(route_depot) + numpy.arange(len(unlocated))
+
+    # stops stay in sweep order within each route (see Config.sequence), farthest routes first
+    groups = {}
+    for i in numpy.lexsort((position, route_of)).tolist():
+      groups.setdefault(int(route_of[i]), []).append(i)
+    merged = sorted(groups.values(), key=lambda r: -numpy.nan_to_num(data.origin_dist[r], nan=numpy.inf).max())
+    return [[data.ids[i] for i in r] for r in merged]
+
+  # private methods
+
+  def _refine(self, route_of, route_depot, located, capacity):
+    """One k-means round: move each order to whichever route's center is nearest it, among its own
+    route and the SWEEP_WINDOW routes either side of it in the sweep (from the same depot), if that
+    route has room. Biggest gains go first. Returns whether any order moved."""
+    data = self.calc.data
+    routes = len(route_depot)
+    rows = numpy.flatnonzero(located & (route_of >= 0))
+    if not len(rows):
+      return False
+    used = route_of[rows]
+    size = numpy.bincount(used, minlength=routes)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+      lats = numpy.bincount(used, weights=data.lat[rows], minlength=routes) / size
+      lons = numpy.bincount(used, weights=data.lon[rows], minlength=routes) / size
+
+    window = numpy.arange(-SWEEP_WINDOW, SWEEP_WINDOW + 1)
+    cand = numpy.clip(used[:, None] + window[None, :], 0, routes - 1)
+    valid = (size[cand] > 0) & (route_depot[cand] == route_depot[used][:, None])
+    D = distance.haversine(data.lat[rows][:, None], data.lon[rows][:, None], lats[cand], lons[cand])
+    D[~valid] = numpy.inf
+    best = numpy.argmin(D, axis=1)
+    target = cand[numpy.arange(len(rows)), best]
+    gain = D[:, SWEEP_WINDOW] - D[numpy.arange(len(rows)), best]
+    loads = numpy.bincount(used, weights=data.count[rows], minlength=routes).astype(numpy.int64)
+
+    moved = False
+    for j in numpy.argsort(-gain, kind="stable").tolist():
+      if gain[j] <= 1e-9:
+        break
+      i, to = int(rows[j]), int(target[j])
+      c = int(data.count[i])
+      if loads[to] + c > capacity:
+        continue
+      loads[route_of[i]] -= c
+      loads[to] += c
+      route_of[i] = to
+      moved = True
+    return moved
+
+SOLVERS = { s.name: s for s in (GreedySolver, SavingsSolver, SweepSolver) }
+
+def get_solver(name, calc):
+  if name not in SOLVERS:
+    raise ValueError("Unknown solver '{}' (choose from {})".format(name, ", ".join(sorted(SOLVERS))))
+  return SOLVERS[name](calc)
@@ -0,0 +1,120 @@
+import math
+import numpy
+
+from lib import distance
+
+MILES_PER_DEGREE = distance.EARTH_RADIUS_MILES * math.pi / 180.0
+
+class GridIndex:
+  """Buckets points into a lat/lon grid of roughly cell_miles square cells.
+
+  Answers "which points are within R miles of here, nearest first" by only looking at the
+  cells that can possibly hold such points, rather than at every point.
+  """
+  def __init__(self, lats, lons, cell_miles):
+    self.lats = numpy.asarray(lats, dtype=numpy.float64)
+    self.lons = numpy.asarray(lons, dtype=numpy.float64)
+    self.cell_miles = float(cell_miles)
+
+    # Points that failed to geocode (NaN) keep their index but are never placed in a cell
+    located = numpy.flatnonzero(numpy.isfinite(self.lats) & numpy.isfinite(self.lons))
+
+    # Size longitude steps for the latitude farthest from the equator so that no cell is ever
+    # narrower than cell_miles, which keeps the ring search below correct
+    max_lat = numpy.abs(self.lats[located]).max() if len(located) else 0.0
+    self.lat_step = self.cell_miles / MILES_PER_DEGREE
+    self.lon_step = self.cell_miles / (MILES_PER_DEGREE * max(math.cos(math.radians(min(max_lat, 89.0))), 0.01))
+
+    self.cells = {}
+    if len(located):
+      ys, xs = self._cell(self.lats[located], self.lons[located])
+      keys = numpy.stack((ys, xs), axis=1)
+      uniq, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+      by_cell = numpy.argsort(inverse.ravel(), kind="stable")
+      bounds = numpy.searchsorted(inverse.ravel()[by_cell], numpy.arange(len(uniq) + 1))
+      order = located[by_cell]
+      for c, (y, x) in enumerate(uniq.tolist()):
+        self.cells[(y, x)] = order[bounds[c]:bounds[c + 1]]
+
+  def __len__(self):
+    return len(self.lats)
+
+  def candidates(self, lat, lon, radius):
+    """Indices (in ascending order) of every point in the cells that may lie within radius of lat/lon"""
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+      return numpy.empty(0, dtype=numpy.int64)
+    rings = int(math.ceil(radius / self.cell_miles))
+    y, x = self._cell(lat, lon)
+    found = [self.cells[(y + dy, x + dx)] for dy in range(-rings, rings + 1) for dx in range(-rings, rings + 1)
+             if (y + dy, x + dx) in self.cells]
+    if not found:
+      return numpy.empty(0, dtype=numpy.int64)
+    return numpy.sort(numpy.concatenate(found))
+
+  def query(self, lat, lon, radius, k=None, exclude=None):
+    """Return (indices, distances) of the points within radius miles of lat/lon, nearest first"""
+    idx = self.candidates(lat, lon, radius)
+    if exclude is not None:
+      idx = idx[idx != exclude]
+    dists = distance.haversine(lat, lon, self.lats[idx], self.lons[idx])
+    keep = dists <= radius
+    idx, dists = idx[keep], dists[keep]
+    order = numpy.argsort(dists, kind="stable")[:k]
+    return (idx[order], dists[order])
+
+  def nearest(self, lat, lon):
+    """Return (index, distance) of the point closest to lat/lon, or (None, None) if the index (or lat/lon)
+    has no location"""
+    if not self.cells or not (math.isfinite(lat) and math.isfinite(lon)):
+      return (None, None)
+
+    radius = self.cell_miles
+    while True:
+      idx, dists = self.query(lat, lon, radius, 1)
+      if len(idx):
+        return (int(idx[0]), float(dists[0]))
+      radius *= 2
+
+  def nearest_many(self, lats, lons):
+    """nearest() for many points at once: (indices, distances) arrays of the closest indexed point to each
+    (-1 and NaN for points without a location).
+
+    Points sharing a grid cell are looked up together, against the same candidate cells.
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    found = numpy.full(len(lats), -1, dtype=numpy.int64)
+    dists = numpy.full(len(lats), numpy.nan)
+    located = numpy.flatnonzero(numpy.isfinite(lats) & numpy.isfinite(lons))
+    if not self.cells or not len(located):
+      return (found, dists)
+
+    ys, xs = self._cell(lats[located], lons[located])
+    uniq, inverse = numpy.unique(numpy.stack((ys, xs), axis=1), axis=0, return_inverse=True)
+    by_cell = numpy.argsort(inverse.ravel(), kind="stable")
+    bounds = numpy.searchsorted(inverse.ravel()[by_cell], numpy.arange(len(uniq) + 1))
+    order = located[by_cell]
+    for c in range(len(uniq)):
+      members = order[bounds[c]:bounds[c + 1]]
+      radius = self.cell_miles
+      while True:
+        # the candidates are the same for every point of the cell and hold all indexed points within
+        # radius of any of them, so once each one's nearest candidate is inside radius it's the nearest
+        idx = self.candidates(lats[members[0]], lons[members[0]], radius)
+        if len(idx):
+          D = distance.haversine(lats[members][:, None], lons[members][:, None], self.lats[idx][None, :], self.lons[idx][None, :])
+          best = numpy.argmin(D, axis=1)
+          best_dists = D[numpy.arange(len(members)), best]
+          if best_dists.max() <= radius:
+            found[members] = idx[best]
+            dists[members] = best_dists
+            break
+        radius *= 2
+    return (found, dists)
+
+  def _cell(self, lats, lons):
+    ys = numpy.floor(numpy.asarray(lats) / self.lat_step).astype(numpy.int64)
+    xs = numpy.floor(numpy.asarray(lons) / self.lon_step).astype(numpy.int64)
+    if ys.ndim == 0:
+      return (int(ys), int(xs))
+    return (ys, xs)
@@ -0,0 +1,116 @@
+from array import array
+
+import json
+import sys
+import os
+
+# Compact separators, one record per line: the whole point is to not pay for indent=2
+SEPARATORS = (",", ":")
+
+def is_ndjson(savefile):
+  return savefile.endswith(".ndjson")
+
+def write_ndjson(savefile, records, encoder=None):
+  """Write each record as one line of JSON, along with an index of where each line starts"""
+  offsets = []
+  with open(savefile, "wb") as f:
+    for record in records:
+      offsets.append(f.tell())
+      f.write(json.dumps(record, separators=SEPARATORS, cls=encoder).encode("utf-8"))
+      f.write(b"\n")
+  _write_index(savefile, offsets)
+  return len(offsets)
+
+def open_routes(savefile):
+  """Routes (lists of order dicts) for reading one at a time: an indexed RecordFile for .ndjson files,
+  otherwise the whole routes.json"""
+  if is_ndjson(savefile):
+    return RecordFile(savefile)
+  with open(savefile, 'r') as json_data:
+    return json.load(json_data)
+
+def iter_ndjson(savefile):
+  """Stream the records of an NDJSON file one at a time"""
+  with open(savefile, "rb") as f:
+    for line in f:
+      if line.strip():
+        yield json.loads(line)
+
+class RecordFile:
+  """Random access to the records of an NDJSON file (e.g. routes.ndjson, one route per line).
+
+  Jumping to record N reads just that line, using the offsets saved next to the file in
+  <file>.idx. The index is rebuilt whenever the file's size or modification time differs from
+  when it was written (e.g. after a hand edit), or an offset turns out not to start a line.
+  """
+  def __init__(self, savefile):
+    self.savefile = savefile
+    self.offsets = _read_index(savefile)
+    if self.offsets is None:
+      self.offsets = _build_index(savefile)
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def __getitem__(self, n):
+    if n < 0:
+      n += len(self.offsets)
+    if n < 0 or n >= len(self.offsets):
+      raise IndexError(n)
+    with open(self.savefile, "rb") as f:
+      if not _line_start(f, int(self.offsets[n])):
+        self.offsets = _build_index(self.savefile)
+        if n >= len(self.offsets):
+          raise IndexError(n)
+      f.seek(int(self.offsets[n]))
+      return json.loads(f.readline())
+
+  def __iter__(self):
+    return iter_ndjson(self.savefile)
+
+# private methods
+
+def _index_file(savefile):
+  return savefile + ".idx"
+
+def _write_index(savefile, offsets):
+  # the first two entries are the size and modification time (in ns) of the data file the offsets
+  # were taken from; stored as little-endian int64
+  stat = os.stat(savefile)
+  index = array("q", [stat.st_size, stat.st_mtime_ns] + list(offsets))
+  if sys.byteorder == "big":
+    index.byteswap()
+  with open(_index_file(savefile), "wb") as f:
+    index.tofile(f)
+
+def _read_index(savefile):
+  indexfile = _index_file(savefile)
+  if not os.path.isfile(indexfile):
+    return None
+  index = array("q")
+  with open(indexfile, "rb") as f:
+    index.frombytes(f.read())
+  if sys.byteorder == "big":
+    index.byteswap()
+  stat = os.stat(savefile)
+  if len(index) < 2 or index[0] != stat.st_size or index[1] != stat.st_mtime_ns:
+    return None
+  return index[2:]
+
+def _build_index(savefile):
+  offsets = []
+  with open(savefile, "rb") as f:
+    pos = 0
+    for line in f:
+      if line.strip():
+        offsets.append(pos)
+      pos += len(line)
+  _write_index(savefile, offsets)
+  return array("q", offsets)
+
+def _line_start(f, offset):
+  """Whether offset is the start of a line of f (the start of the file or just after a newline)"""
+  if offset == 0:
+    return True
+  f.seek(offset - 1)
+  return f.read(1) == b"\n"
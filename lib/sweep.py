@@ -0,0 +1,167 @@
+from multiprocessing import Pool, shared_memory
+
+import itertools
+import copy
+import csv
+
+import numpy
+
+from lib import depots
+from lib import metrics
+from lib import sequencing
+from lib.adjacency import Adjacencies
+from lib.consolidate import consolidate, utilization
+from lib.export import truck_type
+from lib.route_calc import RouteCalc
+from lib.solvers import get_solver
+
+# filled in by _attach in each sweep worker: the config, the orders and the shared neighbor lists
+_worker = {}
+
+class SweepResult:
+  """One point of a parameter sweep: the Config values it set, how its routes scored, and the routes"""
+  __slots__ = ("params", "miles", "trucks", "mix", "utilization", "routes")
+
+  def __init__(self, params, miles, mix, utilization, routes):
+    self.params = params
+    self.miles = miles
+    self.trucks = sum(mix.values())
+    self.mix = mix
+    self.utilization = utilization
+    self.routes = routes
+
+  def mix_label(self):
+    return ", ".join("{} {}".format(n, t) for t, n in self.mix.items())
+
+def grid_runs(grid):
+  """Every combination of a grid ({Config field: [values]}) as a list of {field: value} dicts"""
+  fields = list(grid)
+  return [dict(zip(fields, values)) for values in itertools.product(*(grid[f] for f in fields))]
+
+def sweep(calc, grid):
+  """Route calc's orders once for every combination of the grid's Config values, across a process pool,
+  returning the SweepResults best first (fewest miles, then fewest trucks, then fullest trucks).
+
+  The neighbor lists are built once, for the largest neighbor_radius/max_neighbors in the grid, and
+  shared with every worker through shared memory; runs with a smaller radius just look less far, and
+  each run keeps only its own max_neighbors of every list.
+  """
+  cfg = calc.cfg
+  runs = grid_runs(grid)
+  radius = max([cfg.neighbor_radius] + list(grid.get("neighbor_radius", [])))
+  k = max([cfg.max_neighbors] + list(grid.get("max_neighbors", [])))
+
+  if cfg.verbose:
+    print("Calculating adjacencies within {} miles for {} sweep runs".format(radius, len(runs)))
+  with metrics.stage("adjacency"):
+    adjacencies = Adjacencies.build(calc.data.ids, calc.data.lat, calc.data.lon, radius, k)
+    adjacencies = calc.apply_road_distances(adjacencies)
+
+  blocks = []
+  specs = []
+  try:
+    for name in Adjacencies.ARRAYS:
+      array = numpy.ascontiguousarray(getattr(adjacencies, name))
+      block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+      blocks.append(block)
+      numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+      specs.append((name, block.name, array.shape, array.dtype.str))
+
+    with metrics.stage("sweep"):
+      with Pool(processes=cfg.processes, initializer=_attach, initargs=(cfg, calc.data, specs, radius, k)) as pool:
+        results = pool.map(_run, runs, 1)
+  finally:
+    for block in blocks:
+      block.close()
+      block.unlink()
+
+  metrics.count("sweep_runs", len(results))
+  results.sort(key=lambda r: (r.miles, r.trucks, -r.utilization))
+  return results
+
+def score(calc, routes):
+  """(miles, truck mix, utilization) of routes: the round trips from each route's depot in stop order,
+  how many of each truck they need, and the share of those trucks' capacity that's used"""
+  cfg = calc.cfg
+  miles = 0.0
+  mix = {t["type"]: 0 for t in cfg.trucks}
+  loads = []
+  for route in routes:
+    # orders that failed to geocode can't be measured, the drive is counted over the rest
+    rows = calc.data.rows(route)
+    located = [id for id, lat in zip(route, calc.data.lat[rows].tolist()) if lat == lat]
+    if located:
+      D = calc.route_matrix(located)
+      miles += sequencing.tour_length(D, range(len(D)))
+    load = int(calc.data.count[rows].sum())
+    truck = truck_type(cfg, load)
+    mix[truck] = mix.get(truck, 0) + 1
+    loads.append(load)
+  mix = {t: n for t, n in mix.items() if n}
+  return (miles, mix, utilization(cfg, loads))
+
+def save_table(config, results, savefile):
+  """Write the ranked sweep results as a CSV, one row per run"""
+  fields = []
+  for r in results:
+    fields.extend(f for f in r.params if f not in fields)
+  with open(savefile, "w") as f:
+    writer = csv.writer(f)
+    writer.writerow(["Rank"] + fields + ["Miles", "Trucks", "Truck Mix", "Utilization"])
+    for rank, r in enumerate(results):
+      writer.writerow([rank + 1] + [_label(r.params.get(f)) for f in fields] +
+                      ["{:.1f}".format(r.miles), r.trucks, r.mix_label(), "{:.3f}".format(r.utilization)])
+
+  if config.verbose:
+    print("Saved {} sweep results to {}".format(len(results), savefile))
+
+# private methods
+
+def _attach(config, orders, specs, radius, k):
+  """Pool initializer: map the shared neighbor arrays into this worker without copying them"""
+  arrays = {}
+  blocks = []
+  for (name, block_name, shape, dtype) in specs:
+    block = shared_memory.SharedMemory(name=block_name)
+    blocks.append(block)
+    arrays[name] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=block.buf)
+  _worker["config"] = config
+  _worker["orders"] = orders
+  # the blocks have to stay open for as long as the arrays over them are used
+  _worker["blocks"] = blocks
+  _worker["adjacencies"] = Adjacencies(orders.ids, arrays["lats"], arrays["lons"], arrays["indptr"],
+                                       arrays["neighbors"], arrays["dists"], radius, k)
+
+def _run(params):
+  config = copy.copy(_worker["config"])
+  for field, value in params.items():
+    setattr(config, field, value)
+  calc = RouteCalc(config)
+  calc.data = _worker["orders"]
+  if "depots" in params or "origin" in params:
+    # the orders go to the depots of this run, on a copy so the other runs keep theirs
+    calc.data = calc.data.subset(range(len(calc.data)))
+    calc.assign_depots(calc.data)
+
+  # each depot (or sector around one) is routed on its own like RouteCalc.route does, over its part of
+  # the shared neighbor lists cut down to this run's max_neighbors
+  routes = []
+  for (_, _, rows) in depots.partitions(config, calc.data):
+    part = RouteCalc(config)
+    part.data = calc.data.subset(rows)
+    solver = get_solver(config.solver, part)
+    routes.extend(solver.solve(_worker["adjacencies"].subset(rows, config.max_neighbors) if solver.needs_adjacencies else None))
+  if config.consolidate:
+    routes = consolidate(calc, routes)
+  if config.sequence:
+    # one route at a time, a sweep worker is already one of the pool's processes
+    tours = [sequencing.improve_tour(calc.route_matrix(route), config.sequence_time_budget) for route in routes]
+    routes = [[route[i - 1] for i in tour[1:]] for route, tour in zip(routes, tours)]
+  (miles, mix, utilization) = score(calc, routes)
+  return SweepResult(params, miles, mix, utilization, routes)
+
+def _label(value):
+  # truck lists are shown as their capacities, e.g. "Box Truck 138/18' Flatbed 225"
+  if isinstance(value, list) and value and isinstance(value[0], dict):
+    return "/".join("{} {}".format(t["type"], t["capacity"]) for t in value)
+  return value
@@ -4,33 +4,59 @@ from multiprocessing import Pool
 
 import argparse
 import datetime
+import hashlib
 import urllib
 import json
-import time
-import csv
+import re
 import sys
 import os
 
+from lib import depots
+from lib import metrics
 from lib.config import Config
-from lib.mypdf import MyFPDF
+from lib.consolidate import unused_space, utilization
+from lib.export import export_routes, truck_type
+from lib.orders import load_routes
+from lib.store import open_routes
 
-from selenium import webdriver
-from time import sleep
+# Bump whenever gen_html (or anything else that changes what a PDF looks like) changes, so every
+# route is printed again
+TEMPLATE_VERSION = 1
 
-def print_routes(config, routes):
+def print_routes(config, routes, force=False):
   # Process the routes to generate PDFs for the drivers
   bags       = 0
   deliveries = 0
   big_truck  = 0
-  pool       = Pool(processes=config.processes)
-  args       = [(config, "Route-{}".format(idx+1), d) for idx, d in enumerate(routes)]
-  results    = pool.map(generate_pdf, args, 1)
+  loads      = []
 
-  for res in results:
-    bags += res[0]
-    if res[0] > 135:
+  # Only print the routes whose content changed since the last run (or whose PDF went missing)
+  manifest = load_manifest(config)
+  hashes   = {"Route-{}".format(idx+1): route_hash(config, d) for idx, d in enumerate(routes)}
+  args     = [(config, "Route-{}".format(idx+1), d) for idx, d in enumerate(routes)
+              if force or manifest.get("Route-{}".format(idx+1)) != hashes["Route-{}".format(idx+1)]
+              or not os.path.isfile("{}/Route-{}.pdf".format(config.output_dir, idx+1))]
+  remove_orphans(config, len(routes))
+
+  if config.verbose:
+    print("Printing {} of {} routes ({} unchanged)".format(len(args), len(routes), len(routes) - len(args)))
+
+  # With the browser renderer the maps are screenshotted by a few long-lived browsers first, the static
+  # renderer draws each map as part of building its PDF
+  if config.map_renderer == "browser" and args:
+    take_screenshots(config, args)
+  if args:
+    with metrics.stage("pdf"), Pool(processes=config.processes) as pool:
+      pool.map(generate_pdf, args, 1)
+  save_manifest(config, hashes)
+
+  for r in routes:
+    b = total_bags(r)
+    bags += b
+    loads.append(b)
+    if b > config.trucks[0]["capacity"]:
       big_truck += 1
-    deliveries += res[1]
+    deliveries += total_deliveries(r)
 
   # for a in args:
   #   b, d = generate_pdf(a)
@@ -39,47 +65,61 @@ def print_routes(config, routes):
 
   if config.verbose:
     print("{} bags delivered to {} addresses across {} routes ({} big truck routes).".format(bags, deliveries, len(routes), big_truck))
+    print("The trucks are {:.1%} full, {} bags of space left on them.".format(utilization(config, loads), unused_space(config, loads)))
 
-def generate_orders_csv(config, routes):
-  """Generate a CSV with the following columsn: Order ID, Route, Name, Address, Bag Count, Comments"""
-  savefile = "{}/orders.csv".format(config.output_dir)
-
-  with open(savefile, "w") as csvfile:
-    f = csv.writer(csvfile)
-
-    # Write CSV Header, If you dont need that, remove this line
-    f.writerow(["ID", "Route", "Name", "Address", "Bag Count", "Comments"])
-
-    for idx, route in enumerate(routes):
-      for d in route:
-        f.writerow([d['id'], "route-{}".format(idx+1), d['name'], d['address'], d['count'], d['comments']])
-
+# private methods
+def route_hash(config, route):
+  """Hash of everything that ends up on a route's PDF"""
+  content = [TEMPLATE_VERSION, config.contact, config.map_renderer, route_depot(config, route),
+             [[d['id'], d['name'], d['address'], d['count'], d['comments'], d['lat'], d['lon']] for d in route]]
+  return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+def route_depot(config, route):
+  """[lat, lon] of the depot the route's truck is loaded at"""
+  return depots.location(config, route[0].get('depot') if route else None)
+
+def load_manifest(config):
+  savefile = "{}/print_manifest.json".format(config.output_dir)
+  if not os.path.isfile(savefile):
+    return {}
+  with open(savefile, 'r') as f:
+    return json.load(f)
+
+def save_manifest(config, hashes):
+  savefile = "{}/print_manifest.json".format(config.output_dir)
+  with open(savefile, 'w') as f:
+    json.dump(hashes, f, indent=2)
+
+def remove_orphans(config, num_routes):
+  """Delete the PDFs and maps of routes numbered past the last one"""
+  for filename in os.listdir(config.output_dir):
+    m = re.match(r"^p?Route-(\d+)(\.pdf|-full\.png)$", filename)
+    if m and int(m.group(1)) > num_routes:
+      os.remove(os.path.join(config.output_dir, filename))
+      if config.verbose:
+        print("Removed {}/{}".format(config.output_dir, filename))
+
+def take_screenshots(config, args):
+  """Screenshot the map of each (config, title, route) into the PNG that generate_pdf expects"""
+  jobs = [(url_for_route(r), screenshot_filename(config, title)) for (_, title, r) in args]
   if config.verbose:
-    print("Saved {} routes to {}".format(len(routes), savefile))
+    print("Taking {} map screenshots with {} browsers".format(len(jobs), min(config.browser_processes, len(jobs))))
 
-def generate_routes_csv(config, routes):
-  """Generate a CSV with the following columns: Route, Order ID, Driver, Time Out, Time In, Duration"""
-  savefile = "{}/routes.csv".format(config.output_dir)
+  # selenium is only loaded when there are maps to screenshot
+  from lib.browser_pool import BrowserPool
 
-  with open(savefile, "w") as csvfile:
-    f = csv.writer(csvfile)
-
-    # Write CSV Header, If you dont need that, remove this line
-    f.writerow(["Route", "Bag Count", "Deliveries", "Stops", "Driver", "Time Out", "Time In", "Duration"])
+  # webkit2png doesn't work with Python3
+  #os.system("webkit2png -D %s -o p%s -F -W 1440 -H 900 \"%s\" 1>&2 >/dev/null" % (config.output_dir, title, url))
+  with metrics.stage("screenshot"), BrowserPool(config, min(config.browser_processes, len(jobs))) as browsers:
+    browsers.screenshot_many(jobs)
 
-    for idx, route in enumerate(routes):
-      counter = 0
-      deliveries = []
-      for d in route:
-        counter += int(d['count'])
-        deliveries.append(d['id'])
-      f.writerow(["route-{}".format(idx+1), counter, ";".join(deliveries), len(deliveries), "", "", "", ""])
+def screenshot_filename(config, title):
+  return "%s/p%s-full.png" % (config.output_dir, title)
 
-  if config.verbose:
-    print("Saved {} routes to {}".format(len(routes), savefile))
-
-# private methods
 def generate_pdf(arg):
+  from lib.map_render import RouteMap
+  from lib.mypdf import MyFPDF
+
   config = arg[0]
   title  = arg[1]
   r  = arg[2]
@@ -87,18 +127,11 @@ def generate_pdf(arg):
   if config.verbose:
     print("Working on {}/{}.pdf".format(config.output_dir, title))
 
-  url  = url_for_route(r)
   bags = total_bags(r)
   deliveries = total_deliveries(r)
-
-  filename = "%s/p%s-full.png" % (config.output_dir, title)
-  # webkit2png doesn't work with Python3
-  #os.system("webkit2png -D %s -o p%s -F -W 1440 -H 900 \"%s\" 1>&2 >/dev/null" % (config.output_dir, title, url))
-  driver = webdriver.Firefox()
-  driver.get(url)
-  time.sleep(10)
-  driver.save_screenshot(filename)
-  driver.quit()
+  filename = screenshot_filename(config, title)
+  if config.map_renderer == "static":
+    RouteMap(config).render(route_depot(config, r), [(order['lat'], order['lon']) for order in r], filename)
 
   pdf = MyFPDF()
   pdf.set_margins(1.0, 0.5)
@@ -118,12 +151,6 @@ def total_bags(route):
 def total_deliveries(route):
   return len(route)
 
-def truck_type(config, count):
-  for t in config.trucks:
-    if count <= int(t['capacity']):
-      return t['type']
-  return "!INVALID!"
-
 def gen_html(config, title, bags, r, img):
   truck = truck_type(config, bags)
   now = datetime.datetime.now()
@@ -166,6 +193,10 @@ def validate_routes(routes):
   seen_ids = {}
   for idx, route in enumerate(routes):
     for d in route:
+      # orders that never geocoded have no distance (None in the JSON files, NaN in an OrderTable)
+      if d['origin_dist'] is None or d['origin_dist'] != d['origin_dist']:
+        print("ERROR: Route-{} delivery {} has no location, it failed to geocode!".format(idx, d['id']))
+        sys.exit(-1)
       if int(d['origin_dist']) > 100:
         print("ERROR: Route-{} delivery {} is {} distance away from the origin!".format(idx, d['id'], d['origin_dist']))
         sys.exit(-1)
@@ -175,34 +206,55 @@ def validate_routes(routes):
       else:
         seen_ids[d['id']] = idx
 
-if __name__ == '__main__':
-  parser = argparse.ArgumentParser(description='Generate PDF delivery routes based on the passed in routes file.')
-  parser.add_argument('filename', type=str, help='the JSON file containing the routes to print')
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Generate PDF delivery routes based on the passed in routes file.')
+  parser.add_argument('filename', type=str, help='the routes.json (or routes.ndjson) file containing the routes to print')
   parser.add_argument('routeno', type=int, nargs='?', help='the route to print')
-  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')  
-  args = parser.parse_args()
+  parser.add_argument('-m', '--maps', choices=['static', 'browser'], default='static', help='draw the route maps offline or screenshot Google Maps')
+  parser.add_argument('-f', '--force', action='store_true', help='print every route, even the unchanged ones')
+  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
+  metrics.add_arguments(parser)
+  args = parser.parse_args(argv)
 
   r = None
   c = Config()
   c.verbose = args.verbose
+  c.map_renderer = args.maps
+  metrics.start(args, c.verbose)
 
   if not os.path.isfile(args.filename):
     print("There is no such file {}!".format(args.filename))
     sys.exit(-1)
 
-  with open(args.filename, 'r') as f:
-    r = json.load(f)
-
-  validate_routes(r)
-
   if args.routeno != None:
+    # Only the one route is held in memory (read straight from its line when given a routes.ndjson
+    # file); the rest are streamed past to check for duplicates and to export the CSVs below
+    r = open_routes(args.filename)
+    validate_routes(r)
     if args.routeno > 0 and args.routeno <= len(r):
-      generate_pdf([c, "Route-{}".format(args.routeno), r[args.routeno - 1]])
+      arg = (c, "Route-{}".format(args.routeno), r[args.routeno - 1])
+      if c.map_renderer == "browser":
+        take_screenshots(c, [arg])
+      with metrics.stage("pdf"):
+        generate_pdf(arg)
+      manifest = load_manifest(c)
+      manifest[arg[1]] = route_hash(c, arg[2])
+      save_manifest(c, manifest)
     else:
       print("ERROR: Invalid route number (max {})!".format(len(r)))
+
+    # Generate the master route list and order list for tracking progress
+    export_routes(c, r, ["orders", "routes"])
   else:
-    print_routes(c, r)
+    with metrics.stage("routes_load"):
+      r = load_routes(args.filename)
+
+    validate_routes(r)
 
-  # Generate the master route list and order list for tracking progress
-  generate_orders_csv(c, r)
-  generate_routes_csv(c, r)
+    print_routes(c, r, args.force)
+
+    # Generate the master route list and order list for tracking progress
+    export_routes(c, r, ["orders", "routes"])
+
+if __name__ == '__main__':
+  main()
@@ -6,47 +6,112 @@ import sys
 import csv
 import os
 
+from lib import metrics
+from lib.adjacency import Adjacencies
 from lib.config import Config
+from lib.export import export_routes
+from lib.store import open_routes
 from lib.route_calc import RouteCalc
 
-def generate_routes_csv(config, routes):
-  """Generate a CSV with the following columns: Route, Order ID, Driver, Time Out, Time In, Duration"""
-  savefile = "{}/routes.csv".format(config.output_dir)
-
-  with open(savefile, "w") as csvfile:
-    f = csv.writer(csvfile)
-    num_orders = 0
-    # Write CSV Header, If you dont need that, remove this line
-    f.writerow(["Route", "Bag Count", "Deliveries", "Stops", "Driver", "Time Out", "Time In", "Duration"])
-    validate_deliveries = {}
-
-    for idx, route in enumerate(routes):
-      counter = 0
-      deliveries = []
-      for d in route:
-        counter += int(d['count'])
-        deliveries.append(d['id'])
-        if d['id'] in validate_deliveries:
-          print("ERROR: order {} appears in multiple deliveries!".format(d['id']))
-        else:
-          validate_deliveries[d['id']] = 1
-        num_orders += 1
-      f.writerow(["route-{}".format(idx+1), counter, ";".join(deliveries), len(deliveries), "", "", "", ""])
-
-  if config.verbose:
-    print("Saved {} routes with {} orders to {}".format(len(routes), num_orders, savefile))
+def read_routes_csv(filename):
+  """The Deliveries column of each row of routes.csv, as lists of order IDs"""
+  delivery_routes = []
+  with open(filename, mode="r", encoding="utf-8-sig") as data_file:
+    for row in csv.DictReader(data_file):
+      d = [id.strip() for id in row['Deliveries'].split(';') if id.strip()]
+      delivery_routes.append(d)
+  return delivery_routes
 
-if __name__ == '__main__':
-  parser = argparse.ArgumentParser(description='Re-generate a routes file based on the passed in CSV file.')
+def load_previous(savefile):
+  """(ids, bags) of each route in the last routes.json, or None when there isn't one"""
+  if not os.path.isfile(savefile):
+    return None
+  return set((tuple(d['id'] for d in route), sum(int(d['count']) for d in route)) for route in open_routes(savefile))
+
+def find_dirty(r, delivery_routes, previous):
+  """Indices of the routes that aren't in the previous routes.json with the same stops, order and bag count
+  (matched by content, so routes renumbered by deleting one aren't counted as changed)"""
+  if previous is None:
+    return list(range(len(delivery_routes)))
+  dirty = []
+  for idx, route in enumerate(delivery_routes):
+    bags = int(r.data.count[r.data.rows(route)].sum())
+    if (tuple(route), bags) not in previous:
+      dirty.append(idx)
+  return dirty
+
+def drop_unknown(r, delivery_routes):
+  """Report and leave out IDs (e.g. typos) that aren't in the orders file"""
+  cleaned = []
+  for idx, route in enumerate(delivery_routes):
+    for id in route:
+      if id not in r.data:
+        print("ERROR: route-{} has unknown order {}!".format(idx+1, id))
+    route = [id for id in route if id in r.data]
+    # a route emptied out while editing is dropped
+    if route:
+      cleaned.append(route)
+  return cleaned
+
+def validate_deliveries(routes):
+  """Report any order that was put on more than one route while editing routes.csv"""
+  seen = set()
+  for route in routes:
+    for d in route:
+      if d['id'] in seen:
+        print("ERROR: order {} appears in multiple deliveries!".format(d['id']))
+      else:
+        seen.add(d['id'])
+
+def validate_missing(r, delivery_routes):
+  """Report orders that are no longer on any route"""
+  routed = set(id for route in delivery_routes for id in route)
+  missing = [id for id in r.data if id not in routed]
+  for id in missing:
+    print("ERROR: order {} is not on any route!".format(id))
+  return missing
+
+def validate_dirty(r, delivery_routes, dirty):
+  """Check the changed routes fit on the biggest truck and that each stop is near another one on its route"""
+  capacity = max(int(t['capacity']) for t in r.cfg.trucks)
+  adjacencies = Adjacencies.load("{}/adjacencies".format(r.cfg.output_dir))
+
+  for idx in dirty:
+    route = delivery_routes[idx]
+    bags = int(r.data.count[r.data.rows(route)].sum())
+    if bags > capacity:
+      print("ERROR: route-{} has {} bags, more than the biggest truck holds ({})!".format(idx+1, bags, capacity))
+    depots = set(r.data[id].depot for id in route)
+    if len(depots) > 1:
+      print("WARNING: route-{} mixes orders from the {} depots, it will be loaded at {}".format(
+            idx+1, ", ".join(str(d) for d in depots), r.data[route[0]].depot))
+
+    if adjacencies is None or len(route) < 2:
+      continue
+    # the neighbor lists from the last routing run, to catch an order pasted onto the wrong route
+    stops = set(adjacencies.index[id] for id in route if id in adjacencies)
+    for id in route:
+      if id not in adjacencies:
+        continue
+      i = adjacencies.index[id]
+      neighbors, _ = adjacencies.row(i)
+      if not stops.intersection(neighbors.tolist()):
+        print("WARNING: route-{} order {} is more than {} miles from its other stops".format(idx+1, id, adjacencies.radius))
+
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Re-generate a routes file based on the passed in CSV file.')
   parser.add_argument('filename', type=str, help='the CSV file containing the routes')
   parser.add_argument('-o', '--orders', help='the orders.json file')
+  parser.add_argument('-p', '--previous', help='the routes.json file the CSV was edited from (defaults to the one in the output directory)')
+  parser.add_argument('--sequence', action='store_true', help='reorder the stops of each changed route to shorten the drive')
   parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
-  args = parser.parse_args()
+  metrics.add_arguments(parser)
+  args = parser.parse_args(argv)
 
   c = Config()
   c.verbose = args.verbose
-  delivery_routes = []
-  
+  metrics.start(args, c.verbose)
+
   if not os.path.isfile(args.filename):
     print("There is no such file {}!".format(args.filename))
     sys.exit(-1)
@@ -57,11 +122,28 @@ if __name__ == '__main__':
   r = RouteCalc(c)
   r.load_json(args.orders)
 
-  with open(args.filename, mode="r", encoding="utf-8-sig") as data_file:
-    for row in csv.DictReader(data_file):
-      d = row['Deliveries'].split(';')
-      delivery_routes.append(d)
+  with metrics.stage("csv_load"):
+    delivery_routes = drop_unknown(r, read_routes_csv(args.filename))
+
+  # Only the routes edited since routes.json was written are re-sequenced and re-checked
+  previous = load_previous(args.previous or r.output_file("routes"))
+  dirty = find_dirty(r, delivery_routes, previous)
+  if c.verbose:
+    print("{} of {} routes changed".format(len(dirty), len(delivery_routes)))
+
+  if args.sequence and dirty:
+    sequenced = r.sequence_routes([delivery_routes[idx] for idx in dirty])
+    for idx, route in zip(dirty, sequenced):
+      delivery_routes[idx] = route
+
+  with metrics.stage("validate"):
+    validate_dirty(r, delivery_routes, dirty)
+    validate_missing(r, delivery_routes)
 
   routes = r.expand_routes(delivery_routes)
   r.save_routes(routes)
-  generate_routes_csv(c, routes)
+  validate_deliveries(routes)
+  export_routes(c, routes, ["routes"])
+
+if __name__ == '__main__':
+  main()
@@ -6,28 +6,50 @@ import sys
 import csv
 import os
 
+from lib import metrics
 from lib.config import Config
 from lib.route_calc import RouteCalc
+from lib.solvers import SOLVERS
+from lib.road_distance import PROVIDERS, missing_setting
 
-if __name__ == '__main__':
-  parser = argparse.ArgumentParser(description='Generate a routes file based on the passed in CSV file.')
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Generate a routes file based on the passed in CSV file.')
   parser.add_argument('filename', type=str, help='the CSV file containing the orders')
+  parser.add_argument('-s', '--solver', choices=sorted(SOLVERS), default='greedy', help='the routing engine to use')
+  parser.add_argument('-d', '--distance', choices=['haversine'] + sorted(PROVIDERS), default='haversine', help='where distances between orders come from')
+  parser.add_argument('-m', '--matrix', help='the CSV of road distances for the file distance provider')
+  parser.add_argument('-c', '--consolidate', action='store_true', help='merge nearby underfilled routes onto fewer trucks')
+  parser.add_argument('--sequence', action='store_true', help='reorder the stops of each route to shorten the drive')
   parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
-  args = parser.parse_args()
+  metrics.add_arguments(parser)
+  args = parser.parse_args(argv)
 
+  metrics.start(args, args.verbose)
   d = []
   
   if not os.path.isfile(args.filename):
     print("There is no such file {}!".format(args.filename))
     sys.exit(-1)
 
-  with open(args.filename, mode="r", encoding="utf-8-sig") as data_file:
+  with metrics.stage("csv_load"), open(args.filename, mode="r", encoding="utf-8-sig") as data_file:
     for row in csv.DictReader(data_file):
       d.append(row)
 
   c = Config()
   c.verbose = args.verbose
+  c.solver = args.solver
+  c.sequence = args.sequence
+  c.consolidate = args.consolidate
+  c.distance_provider = args.distance
+  c.distance_matrix_file = args.matrix
+  missing = missing_setting(c)
+  if missing:
+    print("ERROR: {}!".format(missing))
+    sys.exit(-1)
   r = RouteCalc(c)
   r.load_csv(d)
   rval = r.route()
-  sys.exit(rval)
\ No newline at end of file
+  sys.exit(rval)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import os
+
+from lib.config import Config
+
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Keep the orders and routes loaded in memory and change them through a local HTTP/JSON API.')
+  parser.add_argument('-c', '--csv', type=str, help='start from this orders CSV instead of the orders/routes files in the output directory')
+  parser.add_argument('--host', type=str, help='the address to listen on (defaults to Config.service_host)')
+  parser.add_argument('-p', '--port', type=int, help='the port to listen on (defaults to Config.service_port)')
+  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
+  args = parser.parse_args(argv)
+
+  c = Config()
+  c.verbose = args.verbose
+
+  if args.csv and not os.path.isfile(args.csv):
+    print("There is no such file {}!".format(args.csv))
+    sys.exit(-1)
+
+  from lib.service import RoutingService, serve
+  service = RoutingService.load(c, args.csv)
+  serve(service, args.host or c.service_host, args.port or c.service_port)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+import csv
+import os
+
+from lib import metrics
+from lib.config import Config
+from lib.route_calc import RouteCalc
+from lib.road_distance import PROVIDERS, missing_setting
+from lib.solvers import SOLVERS
+
+def main(argv=None, prog=None):
+  parser = argparse.ArgumentParser(prog=prog, description='Route the orders in the passed in CSV file once for every combination of routing parameters, rank the results and keep the best routes.')
+  parser.add_argument('filename', type=str, help='the CSV file containing the orders')
+  parser.add_argument('-g', '--grid', help='JSON file of Config fields and the values to try for each, e.g. {"neighbor_radius": [2, 3], "trucks": [[...], [...]]}')
+  parser.add_argument('-r', '--radius', type=str, help='comma separated neighbor radii (miles) to try')
+  parser.add_argument('-s', '--solvers', type=str, help='comma separated solvers to try (from {})'.format(", ".join(sorted(SOLVERS))))
+  parser.add_argument('--seeds', type=str, help='comma separated seeds to try (each shuffles the greedy solver\'s start order a little)')
+  parser.add_argument('-d', '--distance', choices=['haversine'] + sorted(PROVIDERS), default='haversine', help='where distances between orders come from')
+  parser.add_argument('-m', '--matrix', help='the CSV of road distances for the file distance provider')
+  parser.add_argument('--sequence', action='store_true', help='reorder the stops of each route before measuring its miles')
+  parser.add_argument('-n', '--top', type=int, default=10, help='how many of the best runs to list')
+  parser.add_argument('-v', '--verbose', action='store_true', help='increase the output verbosity')
+  metrics.add_arguments(parser)
+  args = parser.parse_args(argv)
+
+  metrics.start(args, args.verbose)
+
+  if not os.path.isfile(args.filename):
+    print("There is no such file {}!".format(args.filename))
+    sys.exit(-1)
+
+  grid = {}
+  if args.grid:
+    with open(args.grid, 'r') as f:
+      grid = json.load(f)
+  if args.radius:
+    grid["neighbor_radius"] = [float(r) for r in args.radius.split(",")]
+  if args.solvers:
+    grid["solver"] = [s.strip() for s in args.solvers.split(",")]
+  if args.seeds:
+    grid["seed"] = [int(s) for s in args.seeds.split(",")]
+  unknown = [s for s in grid.get("solver", []) if s not in SOLVERS]
+  if unknown:
+    print("ERROR: Unknown solver {} (choose from {})!".format(", ".join(unknown), ", ".join(sorted(SOLVERS))))
+    sys.exit(-1)
+
+  with metrics.stage("csv_load"), open(args.filename, mode="r", encoding="utf-8-sig") as data_file:
+    d = list(csv.DictReader(data_file))
+
+  c = Config()
+  c.verbose = args.verbose
+  c.sequence = args.sequence
+  c.distance_provider = args.distance
+  c.distance_matrix_file = args.matrix
+  unknown = [field for field in grid if not hasattr(c, field)]
+  if unknown:
+    print("ERROR: Unknown Config field {} in the grid!".format(", ".join(unknown)))
+    sys.exit(-1)
+
+  missing = missing_setting(c)
+  if missing:
+    print("ERROR: {}!".format(missing))
+    sys.exit(-1)
+
+  # imported here so that a bad grid is reported before the heavier modules load
+  from lib.sweep import sweep, save_table
+
+  r = RouteCalc(c)
+  r.load_csv(d)
+  results = sweep(r, grid)
+
+  for rank, result in enumerate(results[:args.top]):
+    params = ", ".join("{}={}".format(f, v) for f, v in result.params.items() if f != "trucks")
+    if "trucks" in result.params:
+      params += ", trucks={}".format("/".join(str(t["capacity"]) for t in result.params["trucks"]))
+    print("{:>3}. {:9.1f} miles {:>4} trucks {:6.1%} full  {}  ({})".format(
+          rank + 1, result.miles, result.trucks, result.utilization, params or "defaults", result.mix_label()))
+
+  save_table(c, results, "{}/sweep.csv".format(c.output_dir))
+
+  # keep the best run's routes for printing and the other tools
+  r.save_routes(r.expand_routes(results[0].routes))
+
+if __name__ == '__main__':
+  main()